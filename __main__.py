@@ -3,29 +3,51 @@ import pulumi
 
 import cluster
 import environment
+import preflight
+import tracing
 
 config = pulumi.Config()
 env_config = config.require_object('env')
 cluster_config = config.require_object('cluster')
 
+# Validate the whole configuration locally before any remote calls are made
+with tracing.span('preflight.validate'):
+    preflight.validate(env_config, cluster_config)
+
 # Build the environment for deploying the cluster
-env = environment.Environment.from_config(env_config)
+with tracing.span('environment.from_config'):
+    env = environment.Environment.from_config(env_config)
+
+# Reference the previous deployment of this stack to keep its etcd members
+previous = pulumi.StackReference(cluster_config.get('state_reference', pulumi.get_stack()))
+previous_cluster = previous.get_output('cluster')
+
+# Deployments made before etcd placement was exported used the first three nodes as etcd members
+previous_etcd = previous_cluster.apply(
+    lambda prev: prev.get('etcd', (prev['masters'] + prev['workers'])[:cluster.ETCD_MEMBERS]) if prev else None)
 
 # Create cluster
-c = cluster.Cluster(
-    name=cluster_config['name'],
-    props=cluster.ClusterProperties(
-        nodes=cluster_config['nodes'],
-        masters=cluster_config['masters'],
-        env=env,
+with tracing.span('cluster'):
+    c = cluster.Cluster(
+        name=cluster_config['name'],
+        props=cluster.ClusterProperties(
+            nodes=cluster_config['nodes'],
+            masters=cluster_config['masters'],
+            env=env,
+            previous_etcd=previous_etcd,
+        )
     )
-)
 
 pulumi.export("cluster", {
     "name": c.name,
     "node_count": c.node_count,
     "masters": c.masters,
     "workers": c.workers,
+    "hosts": c.hosts,
+    "etcd": c.etcd,
+    "ansible": cluster_config.get('ansible', {}),
+    "kubespray": cluster_config.get('kubespray', {}),
+    "downloads": cluster_config.get('downloads', {}),
 })
 
 pulumi.export("environment", {
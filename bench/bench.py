@@ -0,0 +1,275 @@
+"""A benchmark suite which measures how the construction of the Pulumi program scales with the number of nodes.
+
+The program in __main__.py is run under Pulumi mocks, with the vSphere data sources answered by fake invokes and Vault
+replaced with a local stand-in, so no network access is needed. Each cluster size runs in a separate process to measure
+a cold program run (including template compilation). The following is recorded for each size:
+
+* construct: the time to run the program until every resource has been registered
+* render: the time spent rendering cloud-init templates
+* build_disks: the time spent building disk specifications
+* resources: the number of resources registered
+
+Results are compared against bench/baseline.json and any regression fails the run. The committed baseline only holds
+the resource counts, which don't depend on the machine; timings are only compared once a baseline including them has
+been stored on the machine the benchmarks run on (--update-baseline --timings). Usage:
+
+    python bench/bench.py [--sizes 3,50,200,1000] [--tolerance 0.25] [--update-baseline [--timings]]
+"""
+import argparse
+import asyncio
+import json
+import os
+import runpy
+import subprocess
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'bench', 'baseline.json')
+DEFAULT_SIZES = [3, 50, 200, 1000]
+DEFAULT_TOLERANCE = 0.25
+TIMINGS = ['construct', 'render', 'build_disks']
+
+# Timings below this many seconds are too noisy to be compared
+MIN_COMPARABLE = 0.05
+
+
+def stack_config(nodes: int) -> dict:
+    """Returns the stack configuration used to benchmark a cluster with the given number of nodes."""
+    return {
+        'glab:cluster': {
+            'masters': 3,
+            'name': 'bench',
+            'nodes': nodes,
+        },
+        'glab:env': {
+            'datacenter': 'Bench',
+            'domain': 'bench.local',
+            'network': {
+                'domains': ['bench.local'],
+                'dns_servers': ['10.0.0.1'],
+                'name': 'Bench',
+                'subnet': '10.0.0.0/20',
+            },
+            'name': 'bench',
+            'node': {
+                'master': {'name': 'kubem{index}-{env}', 'network_offset': 10, 'network_size': 40, 'cpus': 2,
+                           'memory': 4096},
+                'worker': {'name': 'kubew{index}-{env}', 'network_offset': 50, 'cpus': 4, 'memory': 8192},
+            },
+            'pools': [
+                {'type': 'cluster', 'name': 'Cluster', 'datastore': 'vsan', 'weight': 1},
+                {'type': 'host', 'name': 'esxi0', 'datastore': 'ssd', 'weight': 2},
+            ],
+            'template': 'kube',
+            'vault_address': 'http://vault.bench.local:8200',
+        },
+    }
+
+
+class FakeVaultClient:
+    """A local stand-in for hvac.Client which never contacts a Vault server."""
+
+    def __init__(self, url=None, session=None, **kwargs):
+        self.url = url
+
+    def create_token(self, **kwargs):
+        return {'auth': {'client_token': 's.benchmark'}}
+
+    def write(self, path, **kwargs):
+        return {'data': {'signed_key': 'ssh-ed25519-cert-v01@openssh.com AAAAbenchmark'}}
+
+
+def install_fake_vault():
+    """Replaces hvac.Client with FakeVaultClient, installing a stub hvac module if hvac is not available."""
+    try:
+        import hvac
+    except ImportError:
+        hvac = types.ModuleType('hvac')
+        sys.modules['hvac'] = hvac
+    hvac.Client = FakeVaultClient
+
+
+def make_mocks(counter: dict):
+    """Creates the Pulumi mocks used to run the program offline.
+
+    Args:
+        counter: A dictionary whose 'resources' entry is incremented for every registered resource
+
+    Returns:
+        A pulumi.runtime.Mocks implementation
+    """
+    import pulumi
+
+    invokes = {
+        'getDatacenter': lambda args: {'id': 'datacenter-1'},
+        'getComputeCluster': lambda args: {'id': 'domain-c1', 'resourcePoolId': 'resgroup-1'},
+        'getHost': lambda args: {'id': 'host-1', 'resourcePoolId': 'resgroup-2'},
+        'getDatastore': lambda args: {'id': 'datastore-' + args.get('name', '')},
+        'getNetwork': lambda args: {'id': 'network-' + args.get('name', '')},
+        'getVirtualMachine': lambda args: {
+            'id': '42000000-0000-0000-0000-000000000000',
+            'guestId': 'ubuntu64Guest',
+            'disks': [{'size': 16, 'thinProvisioned': True, 'eagerlyScrub': False}],
+        },
+    }
+
+    class Mocks(pulumi.runtime.Mocks):
+        # Older SDKs pass positional arguments while newer ones pass a single arguments object
+        def new_resource(self, *args):
+            if len(args) == 1:
+                type_, name, inputs = args[0].typ, args[0].name, args[0].inputs
+            else:
+                type_, name, inputs = args[0], args[1], args[2]
+            counter['resources'] += 1
+            state = dict(inputs)
+            if type_ == 'pulumi:pulumi:StackReference':
+                state['outputs'] = {}
+            return name + '-id', state
+
+        def call(self, *args):
+            if len(args) == 1:
+                token, inputs = args[0].token, args[0].args
+            else:
+                token, inputs = args[0], args[1]
+            return invokes[token.split(':')[-1]](inputs)
+
+    return Mocks()
+
+
+def timed(module, name: str, timings: dict, key: str):
+    """Wraps the function with the given name in the given module so that its total run time is accumulated."""
+    fn = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timings[key] += time.perf_counter() - start
+
+    setattr(module, name, wrapper)
+
+
+async def wait_for_rpcs():
+    """Waits for every outstanding RPC the same way the Pulumi runtime does once a program has finished."""
+    from pulumi.runtime import stack
+    if hasattr(stack, 'wait_for_rpcs'):
+        await stack.wait_for_rpcs()
+        return
+
+    from pulumi.runtime.rpc_manager import RPC_MANAGER
+    while True:
+        await asyncio.sleep(0)
+        if not RPC_MANAGER.rpcs:
+            break
+        await RPC_MANAGER.rpcs.pop()
+
+
+def run(nodes: int) -> dict:
+    """Runs the program under mocks for a cluster with the given number of nodes and returns the measurements."""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    install_fake_vault()
+
+    import pulumi
+    from pulumi.runtime import config
+
+    counter = {'resources': 0}
+    timings = {k: 0.0 for k in TIMINGS}
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    pulumi.runtime.set_mocks(make_mocks(counter), project='glab', stack='bench', preview=False)
+    for key, value in stack_config(nodes).items():
+        config.set_config(key, json.dumps(value))
+
+    import node
+    import templates
+    timed(templates, 'render_encoded', timings, 'render')
+    timed(node, '_build_disks', timings, 'build_disks')
+
+    start = time.perf_counter()
+    runpy.run_path(os.path.join(ROOT, '__main__.py'), run_name='__main__')
+    loop.run_until_complete(wait_for_rpcs())
+    timings['construct'] = time.perf_counter() - start
+
+    return dict(timings, resources=counter['resources'])
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Compares the given results against the given baseline.
+
+    Args:
+        results: The measurements keyed by cluster size
+        baseline: The baseline measurements keyed by cluster size
+        tolerance: The relative slowdown which is tolerated before a timing is considered a regression
+
+    Returns:
+        A list of messages describing each regression
+    """
+    regressions = []
+    for size, result in results.items():
+        expected = baseline.get(size)
+        if expected is None:
+            continue
+        if result['resources'] > expected['resources']:
+            regressions.append("{} nodes: registered {} resources, baseline is {}".format(
+                size, result['resources'], expected['resources']))
+        for key in [k for k in TIMINGS if k in expected]:
+            limit = max(expected[key], MIN_COMPARABLE) * (1 + tolerance)
+            if result[key] > limit:
+                regressions.append("{} nodes: {} took {:.3f}s, baseline is {:.3f}s".format(
+                    size, key, result[key], expected[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='comma separated list of cluster sizes to benchmark')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative slowdown tolerated before a timing is considered a regression')
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--timings', action='store_true',
+                        help='include the timings in the new baseline (only comparable on the same machine)')
+    parser.add_argument('--run', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        print(json.dumps(run(args.run)))
+        return
+
+    results = {}
+    print("{:>6} {:>10} {:>10} {:>12} {:>10}".format('nodes', 'construct', 'render', 'build_disks', 'resources'))
+    for size in [int(s) for s in args.sizes.split(',')]:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--run', str(size)],
+                                         universal_newlines=True)
+        result = json.loads(output.strip().splitlines()[-1])
+        results[str(size)] = result
+        print("{:>6} {:>9.3f}s {:>9.3f}s {:>11.3f}s {:>10}".format(
+            size, result['construct'], result['render'], result['build_disks'], result['resources']))
+
+    if args.update_baseline:
+        if not args.timings:
+            results = {size: {'resources': r['resources']} for size, r in results.items()}
+        with open(BASELINE, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print("Baseline updated")
+        return
+
+    if not os.path.exists(BASELINE):
+        print("No baseline found, run with --update-baseline to create one")
+        return
+
+    with open(BASELINE, 'r') as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print("REGRESSION: " + regression)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""The InventoryCache class used to persist resolved vSphere inventory between Pulumi runs."""
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'glab-deploy', 'inventory')
+REFRESH_ENV = 'GLAB_REFRESH_CACHE'
+
+
+class InventoryCache:
+    """A local, file backed cache of vSphere inventory lookups.
+
+    Static inventory like datacenters, port groups, templates and resource pools rarely changes, yet every preview and
+    update resolves it again through vCenter. The cache persists the values which were resolved during a run to a JSON
+    file and serves them on subsequent runs until they are older than the configured TTL. Each combination of stack and
+    vCenter server has its own file so that stacks pointed at different vCenter servers never share entries. Setting
+    the GLAB_REFRESH_CACHE environment variable (see the --refresh flag of up.sh) ignores any existing entries and
+    replaces them with freshly resolved values.
+    """
+
+    def __init__(self, stack: str, server: str, path: str = DEFAULT_PATH, ttl: int = DEFAULT_TTL,
+                 refresh: bool = False):
+        """Initializes InventoryCache using the given parameters.
+
+        Args:
+            stack: The name of the Pulumi stack the cache belongs to
+            server: The vCenter server the cached values were resolved against
+            path: The directory where cache files are stored
+            ttl: The number of seconds a cached value remains valid for
+            refresh: Whether to ignore existing entries and resolve everything again
+        """
+        self.ttl = ttl
+        self.refresh = refresh
+        self.file = os.path.join(path, '{}-{}.json'.format(_sanitize(stack), _sanitize(server)))
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+
+        if os.path.exists(self.file):
+            try:
+                with open(self.file, 'r') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                # A corrupt cache file is treated the same as a missing one
+                self._entries = {}
+
+    @classmethod
+    def from_config(cls, stack: str, server: str, config: Optional[Dict[str, Any]]):
+        """Creates and returns an inventory cache using the given cache configuration data.
+
+        Args:
+            stack: The name of the Pulumi stack the cache belongs to
+            server: The vCenter server the cached values were resolved against
+            config: A subset of configuration data (env['cache']) used to configure the cache
+
+        Returns:
+            An InventoryCache object, or None if caching has not been enabled
+        """
+        if not config or not config.get('enabled', False):
+            return None
+        return InventoryCache(
+            stack=stack,
+            server=server,
+            path=os.path.expanduser(config.get('path', DEFAULT_PATH)),
+            ttl=config.get('ttl', DEFAULT_TTL),
+            refresh=bool(os.environ.get(REFRESH_ENV)),
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns the cached value for the given key if it exists and has not expired.
+
+        Args:
+            key: The key of the value
+
+        Returns:
+            The cached value or None if there is no valid entry for the given key
+        """
+        if self.refresh or key not in self._entries:
+            return None
+        entry = self._entries[key]
+        if time.time() - entry['time'] > self.ttl:
+            return None
+        return entry['value']
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Stores the given value under the given key.
+
+        Args:
+            key: The key of the value
+            value: A JSON serializable dictionary
+        """
+        self._entries[key] = {'time': time.time(), 'value': value}
+        self._dirty = True
+
+    def save(self):
+        """Persists the cache to disk if it has been modified."""
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+
+        # Write to a temporary file first so that concurrent runs never observe a partially written cache
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.file), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._entries, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.file)
+        self._dirty = False
+
+
+def _sanitize(value: str) -> str:
+    """Converts the given value into a string which is safe to use as part of a file name."""
+    return re.sub(r'[^A-Za-z0-9._-]', '_', value)
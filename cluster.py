@@ -1,29 +1,57 @@
 """The Cluster class and its helper classes."""
-from itertools import cycle
+from typing import Dict, List, Optional
 
 import hvac
 import pulumi
 
 import environment
+import hostkeys
 import node
+import placement
+import rollout
+import tracing
 
 MINIMUM_NUM_NODES = 3
+ETCD_MEMBERS = 3
 
 
 class ClusterProperties:
     """Cluster properties passed to a Cluster and used to initialize and configure it."""
 
-    def __init__(self, nodes: int, masters: int, env: environment.Environment):
+    def __init__(self, nodes: int, masters: int, env: environment.Environment,
+                 previous_etcd: Optional[pulumi.Output] = None):
         """Initializes ClusterProperties using the given parameters.
 
         Args:
             nodes: The number of nodes to create for this cluster
             masters: How many of the nodes are configured to be a kubernetes master
             env: The environment in which to deploy this cluster
+            previous_etcd: An optional output resolving to the hostnames of the etcd members in the previous deployment
+                of this cluster (None if there was no previous deployment)
         """
         self.nodes = nodes
         self.masters = masters
         self.env = env
+        self.previous_etcd = previous_etcd
+
+
+def _etcd_members(selected: List[str], current: List[str], previous: Optional[List[str]]) -> List[str]:
+    """Returns the etcd members of the previous deployment if all of them are still part of the cluster.
+
+    Kubespray does not support changing the members of an existing etcd cluster, so once chosen the members are kept
+    even if a better placement becomes available (i.e. when nodes are added on a faster tier).
+
+    Args:
+        selected: The etcd members selected for the current deployment
+        current: The hostnames of the nodes in the current deployment
+        previous: The etcd members of the previous deployment (None if there was no previous deployment)
+
+    Returns:
+        The etcd members of the cluster
+    """
+    if previous and all(h in current for h in previous):
+        return previous
+    return selected
 
 
 class Cluster(pulumi.ComponentResource):
@@ -61,13 +89,23 @@ class Cluster(pulumi.ComponentResource):
             node.NodeType.WORKER: [],
         }
 
-        client = hvac.Client(url=props.env.vault_address)
-        self.token = client.create_token(policies=['ssh-signer'], lease='60m')['auth']['client_token']
-
-        # Sort pools by weight
+        if props.env.ssh.signing == environment.SIGNING_DEPLOY:
+            # Sign the host keys of every node in a single batch rather than handing each node a Vault token
+            self.token = None
+            with tracing.span('vault.sign_host_keys'):
+                self.host_keys = self.sign_host_keys()
+        else:
+            with tracing.span('vault.create_token'):
+                client = hvac.Client(url=props.env.vault_address)
+                self.token = client.create_token(policies=['ssh-signer'], lease='60m')['auth']['client_token']
+            self.host_keys = {}
+
+        # Sort pools by weight so that ties during placement are resolved in favor of heavier pools
         props.env.pools.sort(key=lambda p: p.weight, reverse=True)
+        self.scheduler = placement.Scheduler(props.env.pools)
+        self.rollout = rollout.Rollout(props.env.rollout) if props.env.rollout is not None else None
 
-        # Distribute the master nodes across the resource pools
+        # Distribute the master nodes across the resource pools, preferring the fastest storage in each failure domain
         self.add_nodes(node.NodeType.MASTER, self.props.masters)
 
         # The number of nodes requested minus the number of masters created should be the number of worker nodes needed
@@ -79,26 +117,71 @@ class Cluster(pulumi.ComponentResource):
                         self.nodes[node.NodeType.MASTER]]
         self.workers = ['{}.{}'.format(w.vm._name.replace("vm-", ""), props.env.domain) for w in
                         self.nodes[node.NodeType.WORKER]]
+
+        # Place etcd on the fastest tier across failure domains, preferring masters when placements are equivalent
+        all_nodes = self.nodes[node.NodeType.MASTER] + self.nodes[node.NodeType.WORKER]
+        selected = placement.select([(self.fqdn(n), n.resource_pool) for n in all_nodes], ETCD_MEMBERS)
+        previous_etcd = props.previous_etcd if props.previous_etcd is not None else pulumi.Output.from_input(None)
+        self.etcd = previous_etcd.apply(lambda p: _etcd_members(selected, self.masters + self.workers, p))
+
+        # Include the details of every node so that Ansible does not need to resolve hosts on its own
+        self.hosts = {
+            self.fqdn(n): {
+                'ip_address': n.ip_address,
+                'type': n.type,
+                'pool': n.resource_pool.name,
+            } for n in all_nodes
+        }
         self.register_outputs({
             "name": self.name,
             "nodes": self.node_count,
             "masters": self.masters,
             "workers": self.workers,
+            "hosts": self.hosts,
+            "etcd": self.etcd,
         })
 
     def add_nodes(self, node_type: node.NodeType, count: int) -> None:
-        """Performs a round-robin distribution of the given node type to the configured environment
+        """Performs a weighted distribution of the given node type to the configured environment
 
-        This method uses the resource pools configured in environment.pools and distributes the number of given node
-        types in a round-robin style to the pools. It's expected that the resource pools are already sorted by weight.
+        This method uses the cluster's scheduler to distribute the number of given node types to the resource pools
+        configured in environment.pools proportional to their weights and within their capacity. Master nodes are
+        additionally spread across the failure domains of the resource pools and placed on the fastest storage tier.
 
         Args:
             node_type: The type of node to create, either MASTER or WORKER
             count: The number of nodes to create and distribute to the configured environment
         """
-        c = cycle(self.props.env.pools)
+        if node_type == node.NodeType.MASTER:
+            settings = self.props.env.master_config
+        else:
+            settings = self.props.env.worker_config
         for i in range(0, count):
-            self.nodes[node_type].append(self.make_node(node_type, next(c)))
+            is_master = node_type == node.NodeType.MASTER
+            pool = self.scheduler.place(node_type, settings.cpus, settings.memory, spread=is_master, fastest=is_master)
+            self.nodes[node_type].append(self.make_node(node_type, pool))
+
+    def fqdn(self, n: node.Node) -> str:
+        """Returns the fully qualified domain name of the given node."""
+        return '{}.{}'.format(n.hostname, self.props.env.domain)
+
+    def sign_host_keys(self) -> Dict[str, Dict[str, Dict[str, str]]]:
+        """Generates and signs the SSH host keys of every node in the cluster.
+
+        Returns:
+            A dictionary mapping each node's hostname to a dictionary of its signed keys keyed by key type
+        """
+        env = self.props.env
+        hostnames = [node.hostname(env.master_config, i, env.name) for i in range(1, self.props.masters + 1)]
+        hostnames += [node.hostname(env.worker_config, i, env.name)
+                      for i in range(1, self.node_count - self.props.masters + 1)]
+        signer = hostkeys.HostKeySigner(
+            vault_address=env.vault_address,
+            stack=pulumi.get_stack(),
+            key_types=env.ssh.key_types,
+            sign_path=env.ssh.sign_path
+        )
+        return signer.sign(hostnames)
 
     def make_node(self, node_type: node.NodeType, pool: environment.ResourcePool) -> node.Node:
         """Creates a node of the given type in the given resource pool.
@@ -110,11 +193,19 @@ class Cluster(pulumi.ComponentResource):
         Returns:
             The created Node object
         """
-        return node.Node(props=node.NodeProperties(
-            index=len(self.nodes[node_type]) + 1,
+        index = len(self.nodes[node_type]) + 1
+        master = node_type == node.NodeType.MASTER
+        settings = self.props.env.master_config if master else self.props.env.worker_config
+        n = node.Node(props=node.NodeProperties(
+            index=index,
             node_type=node_type,
             resource_pool=pool,
             vault_token=self.token,
-            env=self.props.env
+            env=self.props.env,
+            host_keys=self.host_keys.get(node.hostname(settings, index, self.props.env.name)),
+            depends_on=self.rollout.depends_on(pool, master) if self.rollout else None
         ),
             opts=pulumi.ResourceOptions(parent=self))
+        if self.rollout:
+            self.rollout.add(pool, master, n.vm)
+        return n
@@ -0,0 +1,183 @@
+"""A driver which deploys several stacks concurrently by running up.sh for each of them in a process pool.
+
+Every stack is passed to Pulumi using --stack rather than selected, and its outputs snapshot, Kubespray workspace (with
+the inventory copied from inv/<env>) and trace are kept in per-stack directories. The caches which are shared between
+stacks are safe to use concurrently: the Kubespray cache is populated under a lock by kubespray.py and the download
+cache defaults to a directory per cluster. Each deployment runs in two phases: the infrastructure phase (template
+replicas and pulumi up) issues most of the vCenter operations, so only a limited number of stacks may be in it at the
+same time, while the provision phase (Kubespray) only talks to the nodes and runs unrestricted. The output of each stack
+is written to .trace/<stack>/up.log, progress is printed as each phase starts and finishes and a timing summary is
+printed once every deployment has finished. Usage:
+
+    python deploy.py STACK [STACK ...] [--max-vcenter N] [--max-workers N] [--only-provision] [--refresh] [--scale]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List
+
+import tracing
+
+DEFAULT_MAX_VCENTER = 2
+
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+
+
+def log(stack: str, message: str):
+    """Prints a progress message for the given stack."""
+    print("{} [{}] {}".format(time.strftime('%H:%M:%S'), stack, message), flush=True)
+
+
+def env_name(stack: str) -> str:
+    """Returns the name of the environment (glab:env.name) configured for the given stack."""
+    output = subprocess.check_output(['pulumi', 'config', 'get', 'env', '--stack', stack], universal_newlines=True)
+    return json.loads(output)['name']
+
+
+def run_phase(stack: str, name: str, flags: List[str], log_file) -> bool:
+    """Runs a single phase of up.sh for the given stack, recording it as a span.
+
+    Args:
+        stack: The name of the stack
+        name: The name of the phase
+        flags: The flags passed to up.sh
+        log_file: The file the output of up.sh is appended to
+
+    Returns:
+        Whether the phase succeeded
+    """
+    log(stack, "{} started".format(name))
+    start = time.time()
+    with tracing.span('deploy.' + name, category='deploy'):
+        result = subprocess.run(['./up.sh', stack] + flags, stdin=subprocess.DEVNULL, stdout=log_file,
+                                stderr=subprocess.STDOUT)
+    if result.returncode:
+        log(stack, "{} failed after {:.0f}s, see {}".format(name, time.time() - start, log_file.name))
+        return False
+    log(stack, "{} finished in {:.0f}s".format(name, time.time() - start))
+    return True
+
+
+def deploy(stack: str, flags: List[str], only_provision: bool, vcenter) -> Dict[str, Any]:
+    """Deploys the given stack, holding a vCenter slot for the duration of the infrastructure phase.
+
+    Args:
+        stack: The name of the stack
+        flags: Additional flags passed to up.sh
+        only_provision: Whether to skip the infrastructure phase
+        vcenter: A semaphore shared by every deployment which limits concurrent infrastructure phases
+
+    Returns:
+        A dictionary with the status of the deployment and the duration of each phase in seconds
+    """
+    trace_dir = os.path.join('.trace', stack)
+    os.makedirs(trace_dir, exist_ok=True)
+    for name in os.listdir(trace_dir):
+        if name.endswith(('.json', '.jsonl')):
+            os.remove(os.path.join(trace_dir, name))
+    # up.sh appends to a trace file set by the caller, so both phases and the driver's own spans end up in one trace
+    os.environ[tracing.TRACE_ENV] = os.path.join(trace_dir, 'events.jsonl')
+
+    timings: Dict[str, Any] = {'stack': stack, 'status': STATUS_OK}
+    start = time.time()
+    try:
+        with open(os.path.join(trace_dir, 'up.log'), 'w') as log_file:
+            if not only_provision:
+                with tracing.span('deploy.vcenter_wait', category='deploy'):
+                    vcenter.acquire()
+                timings['queued'] = time.time() - start
+                try:
+                    ok = run_phase(stack, 'infrastructure', flags + ['--only-infrastructure'], log_file)
+                finally:
+                    vcenter.release()
+                timings['infrastructure'] = time.time() - start - timings['queued']
+                if not ok:
+                    timings['status'] = STATUS_FAILED
+                    return timings
+
+            provision_start = time.time()
+            if not run_phase(stack, 'provision', flags + ['--only-provision'], log_file):
+                timings['status'] = STATUS_FAILED
+            timings['provision'] = time.time() - provision_start
+        return timings
+    finally:
+        timings['total'] = time.time() - start
+        # Report after up.sh so the trace also contains the driver's own spans, whether or not the deployment failed
+        tracing.report(os.environ[tracing.TRACE_ENV], os.path.join(trace_dir, 'trace.json'),
+                       os.path.join(trace_dir, 'pulumi-events.jsonl'))
+
+
+def summarize(results: List[Dict[str, Any]], wall: float) -> str:
+    """Returns a table of the phase durations of every deployment followed by the overall wall time.
+
+    Args:
+        results: The results returned by deploy for each stack
+        wall: The number of seconds all deployments took together
+
+    Returns:
+        The summary as a string
+    """
+    columns = ['queued', 'infrastructure', 'provision', 'total']
+    width = max([len('stack')] + [len(r['stack']) for r in results])
+    lines = ['{:<{}}  {:<6}  {}'.format('stack', width, 'status', '  '.join('{:>14}'.format(c) for c in columns))]
+    for r in sorted(results, key=lambda r: r['stack']):
+        cells = ['{:>13.0f}s'.format(r[c]) if c in r else '{:>14}'.format('-') for c in columns]
+        lines.append('{:<{}}  {:<6}  {}'.format(r['stack'], width, r['status'], '  '.join(cells)))
+    serial = sum(r.get('total', 0) for r in results)
+    lines.append("Deployed {} stack(s) in {:.0f}s ({:.0f}s if run one at a time)".format(len(results), wall, serial))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('stacks', nargs='+', help='the stacks to deploy')
+    parser.add_argument('--max-vcenter', type=int, default=DEFAULT_MAX_VCENTER,
+                        help='the maximum number of stacks bringing up infrastructure in vCenter at once')
+    parser.add_argument('--max-workers', type=int, help='the maximum number of stacks deployed at once')
+    parser.add_argument('--only-provision', action='store_true', help='only run the Kubespray provisioner')
+    parser.add_argument('--refresh', action='store_true', help='ignore the local vSphere inventory caches')
+    parser.add_argument('--scale', action='store_true', help='only configure the workers added to each stack')
+    args = parser.parse_args()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    if args.max_vcenter < 1:
+        parser.error("--max-vcenter must be at least 1")
+    if len(set(args.stacks)) < len(args.stacks):
+        parser.error("every stack may only be deployed once")
+
+    # Fail before deploying anything if a stack is missing its Kubespray inventory
+    missing = []
+    for stack in args.stacks:
+        inventory = os.path.join('inv', env_name(stack))
+        if not os.path.isdir(inventory):
+            missing.append("{} ({})".format(stack, inventory))
+    if missing:
+        parser.error("no Kubespray inventory found for: {}".format(', '.join(missing)))
+
+    flags = [f for f, enabled in [('--refresh', args.refresh), ('--scale', args.scale)] if enabled]
+    start = time.time()
+    results = []
+    with multiprocessing.Manager() as manager:
+        vcenter = manager.Semaphore(args.max_vcenter)
+        with ProcessPoolExecutor(max_workers=args.max_workers or len(args.stacks)) as executor:
+            futures = {executor.submit(deploy, s, flags, args.only_provision, vcenter): s for s in args.stacks}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    log(futures[future], "failed: {}".format(e))
+                    results.append({'stack': futures[future], 'status': STATUS_FAILED})
+                print("{} of {} stacks finished".format(len(results), len(futures)), flush=True)
+
+    print(summarize(results, time.time() - start))
+    if any(r['status'] != STATUS_OK for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
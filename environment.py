@@ -1,14 +1,67 @@
 """The Environment class and its helper classes."""
 import ipaddress
-from typing import Any, Dict, List
+import os
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
 
+import pulumi
 import pulumi_vsphere as vsphere
 
+import templates
+from cache import InventoryCache
+from ipam import IPAllocator
+from lookup import InventoryLookup
+
+CLONE_FULL = 'full'
+CLONE_LINKED = 'linked'
+CLONE_INSTANT = 'instant'
+CLONE_MODES = (CLONE_FULL, CLONE_LINKED)
+
+DEFAULT_REPLICA_NAME = '{template}-{datastore}'
+
+SIGNING_BOOT = 'boot'
+SIGNING_DEPLOY = 'deploy'
+SIGNING_MODES = (SIGNING_BOOT, SIGNING_DEPLOY)
+KEY_TYPES = ['rsa', 'dsa', 'ecdsa', 'ed25519']
+# Current OpenSSH releases can no longer generate DSA keys, so they can't be generated at deploy time
+DEPLOY_KEY_TYPES = [t for t in KEY_TYPES if t != 'dsa']
+DEFAULT_SIGN_PATH = 'ssh-host/sign/lab'
+
+DEFAULT_GUEST_NET_TIMEOUT = 5
+
+
+def replica_datastores(config: Dict[str, Any]) -> List[str]:
+    """Returns the names of the datastores which need a template replica according to the given configuration data.
+
+    Args:
+        config: The environment configuration data (env)
+
+    Returns:
+        The sorted names of every distinct pool datastore other than the one the template itself resides on
+    """
+    source = config.get('template_replicas', {}).get('source_datastore')
+    return sorted({pool['datastore'] for pool in config['pools']} - {source})
+
+
+def replica_name(config: Dict[str, Any], datastore: str) -> str:
+    """Returns the name of the template replica for the given datastore according to the given configuration data.
+
+    Args:
+        config: The environment configuration data (env)
+        datastore: The name of the datastore the replica resides on
+
+    Returns:
+        The name of the template replica
+    """
+    name = config.get('template_replicas', {}).get('name', DEFAULT_REPLICA_NAME)
+    return name.format(template=config['template'], datastore=datastore)
+
 
 class Network:
     """Represents the IPv4 network being used in the environment."""
 
-    def __init__(self, network_id: str, subnet: ipaddress.IPv4Network, dns_servers: List[str], domains: List[str]):
+    def __init__(self, network_id: str, subnet: ipaddress.IPv4Network, dns_servers: List[str], domains: List[str],
+                 gateway: Optional[str] = None, reserved: Optional[List[str]] = None):
         """ Initializes Network with the given parameters.
 
         Args:
@@ -16,11 +69,30 @@ class Network:
             subnet: The IPv4 subnet (i.e. 192.168.1.0/24)
             dns_servers: The DNS servers for the environment
             domains: The search domains for the environment
+            gateway: The IPv4 gateway of the subnet (defaults to the first usable address)
+            reserved: A list of address ranges (i.e. 192.168.1.1-192.168.1.10) which are never assigned to nodes
         """
         self.id = network_id
         self.subnet = subnet
         self.dns_servers = dns_servers
         self.domains = domains
+        self.allocator = IPAllocator(subnet, gateway, reserved)
+
+    def claim_ranges(self, master_config: 'NodeSettings', worker_config: 'NodeSettings'):
+        """Claims an address range for each node type, sizing unsized ranges to extend up to the next range.
+
+        Args:
+            master_config: The settings of master nodes
+            worker_config: The settings of worker nodes
+        """
+        ranges = sorted([('master', master_config), ('worker', worker_config)], key=lambda r: r[1].network_offset)
+        for i, (range_name, settings) in enumerate(ranges):
+            size = settings.network_size
+            if size is None:
+                size = self.allocator.max_size(settings.network_offset)
+                if i + 1 < len(ranges):
+                    size = min(size, ranges[i + 1][1].network_offset - settings.network_offset)
+            self.allocator.add_range(range_name, settings.network_offset, size)
 
 
 class NodeSettings:
@@ -30,7 +102,8 @@ class NodeSettings:
     of type worker. This class holds this configuration information for each of those types.
     """
 
-    def __init__(self, name: str, network_offset: int, cpus: int, memory: int):
+    def __init__(self, name: str, network_offset: int, cpus: int, memory: int, clone: str = CLONE_FULL,
+                 network_size: Optional[int] = None):
         """ Initializes NodeSettings with the given parameters.
 
         Args:
@@ -38,11 +111,77 @@ class NodeSettings:
             network_offset: The offset used to generate a node's IPv4 address
             cpus: The number of CPUs that will be configured when this node type is created
             memory: The amount of memory in MB that will be configured when this node type is created
+            clone: How the template is cloned when this node type is created, either full or linked
+            network_size: The number of addresses reserved for this node type (defaults to every address up to the
+                next node type's range, a reserved address or the end of the subnet)
         """
+        if clone == CLONE_INSTANT:
+            raise Exception("Invalid clone mode: {}. Instant clones are not supported by the vSphere provider, use {} "
+                            "instead".format(clone, CLONE_LINKED))
+        if clone not in CLONE_MODES:
+            raise Exception("Invalid clone mode: {}. Must be one of: {}".format(clone, ', '.join(CLONE_MODES)))
         self.name = name
         self.network_offset = network_offset
         self.cpus = cpus
         self.memory = memory
+        self.clone = clone
+        self.network_size = network_size
+
+
+class SSHSettings:
+    """Represents the settings used to generate and sign the SSH host keys of nodes.
+
+    By default every node generates its own host keys on first boot and signs them with Vault using a short lived token
+    passed in through cloud-init. Alternatively the host keys of all nodes can be generated and signed in a single
+    batch while the Pulumi program runs, in which case the signed keys are passed in through cloud-init instead.
+    """
+
+    def __init__(self, signing: str = SIGNING_BOOT, key_types: Optional[List[str]] = None,
+                 sign_path: str = DEFAULT_SIGN_PATH):
+        """ Initializes SSHSettings with the given parameters.
+
+        Args:
+            signing: When the host keys are generated and signed, either boot or deploy
+            key_types: The types of host keys to generate (defaults to rsa, dsa, ecdsa and ed25519, without dsa when
+                signing at deploy time)
+            sign_path: The Vault path used to sign host keys
+        """
+        if signing not in SIGNING_MODES:
+            raise Exception("Invalid signing mode: {}. Must be one of: {}".format(signing, ', '.join(SIGNING_MODES)))
+        allowed = DEPLOY_KEY_TYPES if signing == SIGNING_DEPLOY else KEY_TYPES
+        key_types = key_types if key_types is not None else list(allowed)
+        if not key_types or any(t not in allowed for t in key_types):
+            raise Exception("Invalid key types for {} signing: {}. Must be one or more of: {}".format(
+                signing, key_types, ', '.join(allowed)))
+        self.signing = signing
+        self.key_types = key_types
+        self.sign_path = sign_path
+
+
+class RolloutSettings:
+    """Represents the settings used to roll out the virtual machines of a cluster in waves.
+
+    Without rollout settings every virtual machine is created at once. With them the masters are created first, followed
+    by the workers in waves of a fixed size, and the number of clones running at the same time in a single resource pool
+    or on a single datastore is capped. For details refer to the documentation for the rollout.Rollout type.
+    """
+
+    def __init__(self, wave_size: Optional[int] = None, max_per_pool: Optional[int] = None,
+                 max_per_datastore: Optional[int] = None):
+        """ Initializes RolloutSettings with the given parameters.
+
+        Args:
+            wave_size: The number of workers created per wave (all workers are created in a single wave if not set)
+            max_per_pool: The maximum number of concurrent clones per resource pool (unlimited if not set)
+            max_per_datastore: The maximum number of concurrent clones per datastore (unlimited if not set)
+        """
+        for setting, value in [('wave_size', wave_size), ('max_per_pool', max_per_pool),
+                               ('max_per_datastore', max_per_datastore)]:
+            if value is not None and value < 1:
+                raise Exception("Invalid rollout {}: {}. Must be at least one".format(setting, value))
+        self.wave_size = wave_size
+        self.max_per_pool = max_per_pool
+        self.max_per_datastore = max_per_datastore
 
 
 class ResourcePool:
@@ -50,46 +189,93 @@ class ResourcePool:
 
     When nodes are created they are assigned a resource group which determines where the underlying virtual machine for
     the node will be created. The environment may have one or more resource pools defined to deploy nodes in. Each
-    resource pool has an associated weight which determines the distribution of nodes against it. A resource pool which
-    has a higher weight will have more nodes distributed in it. By default the distribution is round-robin style,
-    however, in the case of an uneven number of nodes the resource pools with higher weights will take precedence.
+    resource pool has an associated weight which determines the distribution of nodes against it: a resource pool with
+    twice the weight of another will have twice as many nodes distributed in it. A resource pool may optionally limit
+    the total CPUs and memory of the nodes placed in it, belong to a failure domain, which is used to spread master
+    nodes, and carry a storage tier, which is used to keep masters and etcd members on the fastest storage. For details
+    on how nodes are distributed refer to the documentation for the placement.Scheduler type.
     """
 
-    def __init__(self, id: str, datastore_id: str, weight: int):
+    def __init__(self, id: str, datastore_id: str, weight: int,
+                 name: Optional[str] = None,
+                 datastore: Optional[str] = None,
+                 failure_domain: Optional[str] = None,
+                 cpus: Optional[int] = None,
+                 memory: Optional[int] = None,
+                 tier: Optional[int] = None):
         """ Initializes ResourcePool with the given parameters.
 
         Args:
             id: The unique resource pool id as defined in vSphere
             datastore_id: The unique id of the associated datastore as defined in vSphere
             weight: The weight used to set the priority of this resource pool
+            name: The name of the cluster or host backing this resource pool
+            datastore: The name of the associated datastore as defined in vSphere
+            failure_domain: The failure domain this resource pool belongs to (defaults to the name)
+            cpus: The total number of CPUs available to nodes in this resource pool (unlimited if not set)
+            memory: The total amount of memory in MB available to nodes in this resource pool (unlimited if not set)
+            tier: The storage tier or latency class of this resource pool where lower is faster (slowest if not set)
         """
         self.id = id
         self.datastore_id = datastore_id
         self.weight = weight
+        self.name = name if name is not None else id
+        self.datastore = datastore
+        self.failure_domain = failure_domain if failure_domain is not None else self.name
+        self.cpus = cpus
+        self.memory = memory
+        self.tier = tier
+
+        # The template replica local to the datastore of this pool, set by the environment when replicas are enabled
+        self.template: Optional[vsphere.VirtualMachine] = None
 
     @classmethod
-    def from_config(cls, dc: vsphere.Datacenter, pool_config: Dict[str, Any]):
+    def from_config(cls, dc: vsphere.Datacenter,
+                    pool_config: Dict[str, Any],
+                    lookup: Optional[InventoryLookup] = None):
         """Creates and returns a resource pool using the given resource pool configuration data.
 
         Args:
             dc: The vSphere datacenter this resource group is associated with
             pool_config: A subset of configuration data (env['pools'][x]) used to configure the resource pool
+            lookup: An optional InventoryLookup used to resolve the vSphere objects (a new one is used if not given)
 
         Returns:
             A ResourcePool object configured using the given parameters
         """
+        resource_pool, datastore = cls.submit_lookups(dc, pool_config, lookup or InventoryLookup())
+        capacity = pool_config.get('capacity', {})
+        return ResourcePool(
+            id=resource_pool.result().resource_pool_id,
+            datastore_id=datastore.result().id,
+            weight=pool_config['weight'],
+            name=pool_config['name'],
+            datastore=pool_config['datastore'],
+            failure_domain=pool_config.get('failure_domain'),
+            cpus=capacity.get('cpus'),
+            memory=capacity.get('memory'),
+            tier=pool_config.get('tier')
+        )
+
+    @staticmethod
+    def submit_lookups(dc: vsphere.Datacenter,
+                       pool_config: Dict[str, Any],
+                       lookup: InventoryLookup) -> Tuple[Future, Future]:
+        """Submits the lookups needed to create a resource pool from the given configuration data.
+
+        Args:
+            dc: The vSphere datacenter this resource group is associated with
+            pool_config: A subset of configuration data (env['pools'][x]) used to configure the resource pool
+            lookup: The InventoryLookup used to resolve the vSphere objects
+
+        Returns:
+            A tuple of futures resolving to the compute cluster (or host) and the datastore of the resource pool
+        """
         if pool_config['type'].lower() == 'cluster':
-            return ResourcePool(
-                id=vsphere.get_compute_cluster(str(dc.id), pool_config['name']).resource_pool_id,
-                datastore_id=vsphere.get_datastore(str(dc.id), name=pool_config['datastore']).id,
-                weight=pool_config['weight']
-            )
+            resource_pool = lookup.compute_cluster(str(dc.id), pool_config['name'])
         else:
-            return ResourcePool(
-                id=vsphere.get_host(str(dc.id), pool_config['name']).resource_pool_id,
-                datastore_id=vsphere.get_datastore(str(dc.id), name=pool_config['datastore']).id,
-                weight=pool_config['weight']
-            )
+            resource_pool = lookup.host(str(dc.id), pool_config['name'])
+        return resource_pool, lookup.datastore(str(dc.id), pool_config['datastore'])
 
 
 class Environment:
@@ -109,7 +295,11 @@ class Environment:
                  node_template: vsphere.VirtualMachine,
                  master_config: NodeSettings,
                  worker_config: NodeSettings,
-                 vault_address: str):
+                 vault_address: str,
+                 cloud_init_encoding: str = templates.ENCODING_BASE64,
+                 ssh: Optional[SSHSettings] = None,
+                 rollout: Optional[RolloutSettings] = None,
+                 guest_net_timeout: int = DEFAULT_GUEST_NET_TIMEOUT):
         """ Initializes Environment using the given parameters."""
         self.name = name
         self.datacenter = datacenter
@@ -120,38 +310,99 @@ class Environment:
         self.master_config = master_config
         self.worker_config = worker_config
         self.vault_address = vault_address
+        self.cloud_init_encoding = cloud_init_encoding
+        self.ssh = ssh if ssh is not None else SSHSettings()
+        self.rollout = rollout
+        self.guest_net_timeout = guest_net_timeout
+
+        network.claim_ranges(master_config, worker_config)
 
     @classmethod
     def from_config(cls, config: Dict[str, Any]):
-        dc = vsphere.get_datacenter(config['datacenter'])
-        # Build resource pools
-        pools = []
-        for pool in config['pools']:
-            pools.append(ResourcePool.from_config(dc, pool))
-
-        return Environment(
-            name=config['name'],
-            datacenter=dc,
-            domain=config['domain'],
-            pools=pools,
-            network=Network(
-                network_id=str(vsphere.get_network(dc.id, name=config['network']['name']).id),
-                subnet=ipaddress.ip_network(config['network']['subnet']),
-                dns_servers=config['network']['dns_servers'],
-                domains=config['network']['domains']
-            ),
-            node_template=vsphere.get_virtual_machine(dc.id, name=config['template']),
-            master_config=NodeSettings(
-                name=config['node']['master']['name'],
-                network_offset=config['node']['master']['network_offset'],
-                cpus=config['node']['master']['cpus'],
-                memory=config['node']['master']['memory']
-            ),
-            worker_config=NodeSettings(
-                name=config['node']['worker']['name'],
-                network_offset=config['node']['worker']['network_offset'],
-                cpus=config['node']['worker']['cpus'],
-                memory=config['node']['worker']['memory']
-            ),
-            vault_address=config['vault_address']
-        )
+        server = pulumi.Config('vsphere').get('vsphereServer') or os.environ.get('VSPHERE_SERVER', '')
+        lookup = InventoryLookup(cache=InventoryCache.from_config(pulumi.get_stack(), server, config.get('cache')))
+        success = False
+        try:
+            dc = lookup.datacenter(config['datacenter']).result()
+
+            # Submit every lookup up front so that the invokes are resolved concurrently
+            lookups = {}
+            for pool in config['pools']:
+                resource_pool, datastore = ResourcePool.submit_lookups(dc, pool, lookup)
+                lookups['{} {}'.format(pool['type'].lower(), pool['name'])] = resource_pool
+                lookups['datastore {}'.format(pool['datastore'])] = datastore
+            network = lookup.network(str(dc.id), config['network']['name'])
+            lookups['network {}'.format(config['network']['name'])] = network
+            node_template = lookup.virtual_machine(str(dc.id), config['template'])
+            lookups['template {}'.format(config['template'])] = node_template
+            replicas = {}
+            if config.get('template_replicas', {}).get('enabled', False):
+                for datastore in replica_datastores(config):
+                    replicas[datastore] = lookup.virtual_machine(str(dc.id), replica_name(config, datastore))
+
+            # Confirm that every name exists before building anything so that all missing names are reported at once
+            lookup.wait_all(lookups)
+
+            # Build resource pools
+            pools = []
+            for pool in config['pools']:
+                pools.append(ResourcePool.from_config(dc, pool, lookup))
+
+            # Point each pool at the template replica on its datastore so that nodes are always cloned locally
+            for datastore, replica in replicas.items():
+                if replica.exception() is not None:
+                    raise Exception("Template replica {} was not found on datastore {}. Run replicas.py (or up.sh) to "
+                                    "create it".format(replica_name(config, datastore), datastore))
+                for pool in pools:
+                    if pool.datastore == datastore:
+                        pool.template = replica.result()
+
+            env = Environment(
+                name=config['name'],
+                datacenter=dc,
+                domain=config['domain'],
+                pools=pools,
+                network=Network(
+                    network_id=str(network.result().id),
+                    subnet=ipaddress.ip_network(config['network']['subnet']),
+                    dns_servers=config['network']['dns_servers'],
+                    domains=config['network']['domains'],
+                    gateway=config['network'].get('gateway'),
+                    reserved=config['network'].get('reserved')
+                ),
+                node_template=node_template.result(),
+                master_config=NodeSettings(
+                    name=config['node']['master']['name'],
+                    network_offset=config['node']['master']['network_offset'],
+                    cpus=config['node']['master']['cpus'],
+                    memory=config['node']['master']['memory'],
+                    clone=config['node']['master'].get('clone', CLONE_FULL),
+                    network_size=config['node']['master'].get('network_size')
+                ),
+                worker_config=NodeSettings(
+                    name=config['node']['worker']['name'],
+                    network_offset=config['node']['worker']['network_offset'],
+                    cpus=config['node']['worker']['cpus'],
+                    memory=config['node']['worker']['memory'],
+                    clone=config['node']['worker'].get('clone', CLONE_FULL),
+                    network_size=config['node']['worker'].get('network_size')
+                ),
+                vault_address=config['vault_address'],
+                cloud_init_encoding=config.get('cloud_init_encoding', templates.ENCODING_BASE64),
+                ssh=SSHSettings(
+                    signing=config.get('ssh', {}).get('signing', SIGNING_BOOT),
+                    key_types=config.get('ssh', {}).get('key_types'),
+                    sign_path=config.get('ssh', {}).get('sign_path', DEFAULT_SIGN_PATH)
+                ),
+                rollout=RolloutSettings(
+                    wave_size=config['rollout'].get('wave_size'),
+                    max_per_pool=config['rollout'].get('max_per_pool'),
+                    max_per_datastore=config['rollout'].get('max_per_datastore')
+                ) if 'rollout' in config else None,
+                guest_net_timeout=config.get('guest_net_timeout', DEFAULT_GUEST_NET_TIMEOUT)
+            )
+            success = True
+            return env
+        finally:
+            # Only persist the cache when every lookup succeeded
+            lookup.shutdown(save=success)
@@ -0,0 +1,127 @@
+"""The HostKeySigner class used to generate and sign the SSH host keys of nodes while the Pulumi program runs."""
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+
+import hvac
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'glab-deploy', 'hostkeys')
+
+
+def _expired(cert_file: str) -> bool:
+    """Returns whether the given certificate has expired (or can't be read).
+
+    Args:
+        cert_file: The path to the certificate (as printed by ssh-keygen -L)
+
+    Returns:
+        True if the certificate must be signed again
+    """
+    result = subprocess.run(['ssh-keygen', '-L', '-f', cert_file], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode:
+        return True
+    match = re.search(r'^\s*Valid: (.*)$', result.stdout, re.MULTILINE)
+    if not match:
+        return True
+    if match.group(1).strip() == 'forever':
+        return False
+    # Certificates are either valid "from X to Y", "before Y" or "after X", where the times are in local time
+    end = re.search(r'(?:to|before) (\S+)', match.group(1))
+    if not end:
+        return False
+    return datetime.strptime(end.group(1), '%Y-%m-%dT%H:%M:%S') <= datetime.now()
+
+
+class HostKeySigner:
+    """Generates SSH host keys for a batch of hosts and signs them with Vault.
+
+    Rather than each node signing its host keys on boot, which requires passing a Vault token to every node and causes a
+    burst of Vault requests during large rollouts, all keys are signed in a single pass using a shared Vault session
+    whose connections are pooled across a set of worker threads. Generated keys and their certificates are stored on
+    disk per stack and reused by subsequent runs, so only the keys of new hosts have to be generated and signed. Cached
+    certificates which have expired are signed again so that recreated nodes never receive an expired certificate.
+    """
+
+    def __init__(self, vault_address: str, stack: str, key_types: List[str], sign_path: str,
+                 path: str = DEFAULT_PATH, max_workers: int = DEFAULT_MAX_WORKERS):
+        """Initializes HostKeySigner using the given parameters.
+
+        Args:
+            vault_address: The address of the Vault server used for signing host keys
+            stack: The name of the Pulumi stack the keys belong to
+            key_types: The types of host keys to generate (i.e. ed25519)
+            sign_path: The Vault path used to sign host keys
+            path: The directory where generated keys and certificates are stored
+            max_workers: The maximum number of keys which are generated and signed concurrently
+        """
+        self.key_types = key_types
+        self.sign_path = sign_path
+        self.path = os.path.join(path, stack)
+        self.max_workers = max_workers
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self.client = hvac.Client(url=vault_address, session=session)
+
+    def _sign(self, hostname: str, key_type: str) -> Dict[str, str]:
+        """Returns the host key of the given type for the given host, generating and signing it if necessary.
+
+        Args:
+            hostname: The hostname of the node the key belongs to
+            key_type: The type of the key (i.e. ed25519)
+
+        Returns:
+            A dictionary containing the private key, public key and certificate
+        """
+        key_dir = os.path.join(self.path, hostname)
+        key_file = os.path.join(key_dir, 'ssh_host_{}_key'.format(key_type))
+        cert_file = key_file + '-cert.pub'
+
+        if not os.path.exists(key_file):
+            os.makedirs(key_dir, mode=0o700, exist_ok=True)
+            subprocess.run(['ssh-keygen', '-q', '-t', key_type, '-N', '', '-C', hostname, '-f', key_file],
+                           check=True, stdin=subprocess.DEVNULL)
+            if os.path.exists(cert_file):
+                os.remove(cert_file)
+
+        with open(key_file + '.pub', 'r') as f:
+            public_key = f.read().strip()
+
+        if not os.path.exists(cert_file) or _expired(cert_file):
+            response = self.client.write(self.sign_path, cert_type='host', public_key=public_key)
+            with open(cert_file, 'w') as f:
+                f.write(response['data']['signed_key'].strip())
+
+        with open(key_file, 'r') as f:
+            private_key = f.read().strip()
+        with open(cert_file, 'r') as f:
+            certificate = f.read().strip()
+
+        return {'private_key': private_key, 'public_key': public_key, 'certificate': certificate}
+
+    def sign(self, hostnames: List[str]) -> Dict[str, Dict[str, Dict[str, str]]]:
+        """Generates and signs the host keys of the given hosts in a single batch.
+
+        Args:
+            hostnames: The hostnames of the nodes to sign keys for
+
+        Returns:
+            A dictionary mapping each hostname to a dictionary of its signed keys keyed by key type
+        """
+        jobs = [(h, t) for h in hostnames for t in self.key_types]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hostkeys') as executor:
+            results = list(executor.map(lambda job: self._sign(*job), jobs))
+
+        keys: Dict[str, Dict[str, Dict[str, str]]] = {h: {} for h in hostnames}
+        for (hostname, key_type), result in zip(jobs, results):
+            keys[hostname][key_type] = result
+        return keys
@@ -1,24 +1,195 @@
-"""A small helper script for generating an Ansible inventory file based on the Pulumi stack outputs"""
+#!/usr/bin/env python3
+"""An Ansible dynamic inventory script which builds the Kubespray inventory from a snapshot of the Pulumi stack outputs.
 
+The snapshot is the output of `pulumi stack output --json` and is read from the file named by the GLAB_OUTPUTS_FILE
+environment variable. Every host is given its IP address as ansible_host, along with its node type and resource pool,
+in the _meta.hostvars section so Ansible never has to call this script per host or resolve hostnames over DNS. The
+script has no dependencies beyond the standard library so it can be copied next to the Kubespray group_vars.
+
+The script also generates the ansible.cfg used to run Kubespray, which is layered on top of the configuration shipped
+with Kubespray and sized from the number of nodes in the cluster, as well as the group_vars (in JSON) which configure
+how Kubespray downloads container images and binaries. Usage:
+
+    GLAB_OUTPUTS_FILE=outputs.json ./inv.py --list
+    GLAB_OUTPUTS_FILE=outputs.json ./inv.py --host HOST
+    GLAB_OUTPUTS_FILE=outputs.json ./inv.py --ansible-cfg OUTPUT [--base KUBESPRAY_ANSIBLE_CFG]
+    GLAB_OUTPUTS_FILE=outputs.json ./inv.py --download-vars OUTPUT
+"""
+import argparse
+import configparser
 import json
-import sys
+import os
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+OUTPUTS_ENV = 'GLAB_OUTPUTS_FILE'
+
+MIN_FORKS = 5
+DEFAULT_MAX_FORKS = 50
+DEFAULT_STRATEGY = 'linear'
+STRATEGIES = ['linear', 'free', 'mitogen_linear', 'mitogen_free']
+MITOGEN_STRATEGY_PLUGINS = 'plugins/mitogen/ansible_mitogen/plugins/strategy'
+FACT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'glab-deploy', 'facts')
+FACT_CACHE_TIMEOUT = 86400
+DOWNLOAD_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'glab-deploy', 'downloads')
+SSH_ARGS = '-o ControlMaster=auto -o ControlPersist=30m -o ConnectionAttempts=100 -o UserKnownHostsFile=/dev/null'
+
+
+def hostvars(host: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the Ansible variables of a host from its entry in the cluster output.
+
+    Args:
+        host: The host's entry in the hosts of the cluster output
+
+    Returns:
+        A dictionary of the host's variables
+    """
+    return {
+        'ansible_host': host['ip_address'],
+        'ip': host['ip_address'],
+        'node_type': host['type'],
+        'resource_pool': host['pool'],
+    }
+
+
+def inventory(cluster: Dict[str, Any]) -> Dict[str, Any]:
+    """Builds the Kubespray inventory from the cluster output.
+
+    Args:
+        cluster: The cluster output of the stack
+
+    Returns:
+        The inventory in the JSON format expected from an Ansible dynamic inventory script
+    """
+    all_nodes = cluster['masters'] + cluster['workers']
+
+    return {
+        'all': {'hosts': all_nodes},
+        'kube-master': {'hosts': cluster['masters']},
+        'kube-node': {'hosts': cluster['workers']},
+        'etcd': {'hosts': cluster['etcd']},
+        'calico-rr': {'hosts': []},
+        'k8s-cluster': {'children': ['kube-master', 'kube-node', 'calico-rr']},
+        '_meta': {
+            'hostvars': {name: hostvars(host) for name, host in cluster['hosts'].items()},
+        },
+    }
+
+
+def ansible_config(cluster: Dict[str, Any], base: Optional[str] = None) -> configparser.RawConfigParser:
+    """Builds the Ansible configuration used to run Kubespray against the cluster.
+
+    The number of forks matches the number of nodes (within the configured bounds) so every task runs against all nodes
+    at once. SSH pipelining and persistent control connections avoid repeated connection setup for each task, and facts
+    are cached on disk so they are gathered once rather than on every play and run.
+
+    Args:
+        cluster: The cluster output of the stack
+        base: An optional ansible.cfg (i.e. the one shipped with Kubespray) whose settings are kept unless overridden
+
+    Returns:
+        The Ansible configuration
+    """
+    settings = cluster.get('ansible', {})
+    strategy = settings.get('strategy', DEFAULT_STRATEGY)
+    if strategy not in STRATEGIES:
+        raise Exception("Invalid Ansible strategy: {}. Must be one of: {}".format(strategy, ', '.join(STRATEGIES)))
+    max_forks = int(settings.get('max_forks', DEFAULT_MAX_FORKS))
+
+    config = configparser.RawConfigParser()
+    if base and os.path.exists(base):
+        config.read(base)
+    for section in ('defaults', 'ssh_connection'):
+        if not config.has_section(section):
+            config.add_section(section)
+
+    config.set('defaults', 'forks', str(max(MIN_FORKS, min(cluster['node_count'], max_forks))))
+    config.set('defaults', 'strategy', strategy)
+    if strategy.startswith('mitogen_'):
+        config.set('defaults', 'strategy_plugins', settings.get('mitogen_path', MITOGEN_STRATEGY_PLUGINS))
+    config.set('defaults', 'gathering', 'smart')
+    config.set('defaults', 'fact_caching', 'jsonfile')
+    config.set('defaults', 'fact_caching_connection', os.path.join(FACT_CACHE_PATH, cluster['name']))
+    config.set('defaults', 'fact_caching_timeout', str(FACT_CACHE_TIMEOUT))
+    config.set('ssh_connection', 'pipelining', 'True')
+    config.set('ssh_connection', 'ssh_args', SSH_ARGS)
+    return config
+
+
+def download_vars(cluster: Dict[str, Any]) -> Dict[str, Any]:
+    """Builds the group_vars which configure how Kubespray downloads container images and binaries.
+
+    Every image and binary is downloaded once (on the deploy host by default) into a local cache and distributed to
+    the nodes from there, rather than each node downloading everything on its own. The cache is kept across runs (in a
+    directory per cluster by default, so clusters deployed concurrently don't write to the same files) and Kubespray
+    verifies the checksum of every cached binary before using it. Images can additionally be pulled through a registry
+    mirror.
+
+    Args:
+        cluster: The cluster output of the stack
+
+    Returns:
+        A dictionary of group_vars (empty if downloads are not configured)
+    """
+    settings = cluster.get('downloads', {})
+    if not settings.get('enabled', False):
+        return {}
+
+    variables = {
+        'download_run_once': True,
+        'download_localhost': settings.get('localhost', True),
+        'download_force_cache': True,
+        'download_keep_remote_cache': False,
+        'download_cache_dir': os.path.expanduser(settings.get('cache_dir', os.path.join(DOWNLOAD_CACHE_PATH,
+                                                                                    cluster['name']))),
+    }
+
+    mirror = settings.get('registry_mirror')
+    if mirror:
+        variables['docker_registry_mirrors'] = [mirror]
+        if settings.get('insecure_registry', False):
+            variables['docker_insecure_registries'] = [urlparse(mirror).netloc]
+        # The containerd configuration replaces the defaults of the containerd role, so they must be included
+        variables['containerd_config'] = {
+            'grpc': {'max_recv_message_size': 16777216, 'max_send_message_size': 16777216},
+            'debug': {'level': ''},
+            'registries': {'docker.io': mirror},
+            'max_container_log_line_size': -1,
+            'metrics': {'address': '', 'grpc_histogram': False},
+        }
+    return variables
+
 
-from jinja2 import Template
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--list', action='store_true', help='print the whole inventory')
+    group.add_argument('--host', help='print the variables of the given host')
+    group.add_argument('--ansible-cfg', help='write the ansible.cfg used to run Kubespray to the given path')
+    group.add_argument('--download-vars', help='write the group_vars which configure downloads to the given path')
+    parser.add_argument('--base', help='the ansible.cfg whose settings are kept unless overridden')
+    args = parser.parse_args()
 
-j = json.loads(sys.stdin.read())
+    path = os.environ.get(OUTPUTS_ENV)
+    if not path:
+        parser.error("{} must be set to a snapshot of the stack outputs (pulumi stack output --json)".format(
+            OUTPUTS_ENV))
+    with open(path, 'r') as f:
+        cluster = json.load(f)['cluster']
 
-all_nodes = j['masters'] + j['workers']
-# Min cluster size is 3 nodes, in which case they all need to be etcd members
-# otherwise just grab the first 3 nodes
-if len(all_nodes) <= 3:
-    etcd_nodes = all_nodes
-else:
-    etcd_nodes = all_nodes[:3]
+    if args.list:
+        print(json.dumps(inventory(cluster), indent=2))
+    elif args.ansible_cfg:
+        config = ansible_config(cluster, args.base)
+        with open(args.ansible_cfg, 'w') as f:
+            config.write(f)
+    elif args.download_vars:
+        with open(args.download_vars, 'w') as f:
+            json.dump(download_vars(cluster), f, indent=2)
+    else:
+        host = cluster['hosts'].get(args.host)
+        print(json.dumps(hostvars(host) if host else {}, indent=2))
 
-with open('files/inventory.ini.j2', 'r') as f:
-    rendered = Template(f.read()).render(all=all_nodes,
-                                         masters=j['masters'],
-                                         workers=j['workers'],
-                                         etcd_nodes=etcd_nodes)
 
-print(rendered)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""The IPAllocator class used to assign static IPv4 addresses to nodes."""
+import ipaddress
+from typing import Dict, List, Optional, Tuple
+
+
+def parse_range(subnet: ipaddress.IPv4Network, value: str) -> Tuple[int, int]:
+    """Parses an address range in the form of 'FIRST-LAST' (or a single address) into offsets within the given subnet.
+
+    Args:
+        subnet: The subnet the range belongs to
+        value: The range to parse (i.e. 192.168.1.1-192.168.1.10)
+
+    Returns:
+        A tuple of the first and last offset (inclusive) of the range relative to the subnet's network address
+    """
+    first, _, last = value.partition('-')
+    first = ipaddress.IPv4Address(first.strip())
+    last = ipaddress.IPv4Address(last.strip()) if last else first
+    if first not in subnet or last not in subnet or last < first:
+        raise Exception("Invalid address range: {}. Must be contained in {}".format(value, subnet))
+    return int(first) - int(subnet.network_address), int(last) - int(subnet.network_address)
+
+
+class IPAllocator:
+    """Allocates static IPv4 addresses from named ranges within a subnet.
+
+    Every address of the subnet is represented by a bit, where bit n corresponds to the network address plus n. A
+    bitmap of reserved addresses (the network and broadcast addresses, the gateway and any configured reserved ranges)
+    is computed once, as is a bitmap of the addresses claimed by each range. Ranges may not overlap each other or any
+    reserved address, which guarantees that no two nodes are ever handed the same address.
+
+    Each range also tracks which of its addresses are allocated. The address of a node is determined by its index (the
+    n-th node of a range receives the n-th address of the range), so allocation is deterministic and constant time
+    regardless of the size of the cluster. Addresses of removed nodes are simply no longer allocated and are handed to
+    the next node with the same index.
+    """
+
+    def __init__(self, subnet: ipaddress.IPv4Network, gateway: Optional[str] = None,
+                 reserved: Optional[List[str]] = None):
+        """Initializes IPAllocator using the given parameters.
+
+        Args:
+            subnet: The IPv4 subnet to allocate addresses from
+            gateway: The gateway of the subnet (defaults to the first usable address)
+            reserved: A list of address ranges (i.e. 192.168.1.1-192.168.1.10) which may never be allocated
+        """
+        if subnet.num_addresses < 4:
+            raise Exception("Invalid subnet: {}. Must contain at least two usable addresses".format(subnet))
+        self.subnet = subnet
+        self.gateway = ipaddress.IPv4Address(gateway) if gateway else subnet.network_address + 1
+        if self.gateway not in subnet:
+            raise Exception("Invalid gateway: {}. Must be contained in {}".format(self.gateway, subnet))
+
+        # The network and broadcast addresses and the gateway are always reserved
+        self._reserved = 1 | (1 << (subnet.num_addresses - 1))
+        self._reserved |= 1 << (int(self.gateway) - int(subnet.network_address))
+        for value in reserved or []:
+            first, last = parse_range(subnet, value)
+            self._reserved |= ((1 << (last - first + 1)) - 1) << first
+
+        self._claimed = 0
+        self._ranges: Dict[str, Tuple[int, int]] = {}
+        self._allocated: Dict[str, int] = {}
+
+    @property
+    def prefix_length(self) -> int:
+        """The prefix length of the subnet (i.e. 24)."""
+        return self.subnet.prefixlen
+
+    def max_size(self, offset: int) -> int:
+        """Returns the largest size of a range starting after the given offset which does not overlap anything else.
+
+        Args:
+            offset: The offset of the range (its first address is the network address plus offset plus one)
+
+        Returns:
+            The number of consecutive free addresses following the given offset
+        """
+        taken = (self._reserved | self._claimed) >> (offset + 1)
+        if taken == 0:
+            return max(self.subnet.num_addresses - offset - 1, 0)
+        return (taken & -taken).bit_length() - 1
+
+    def add_range(self, name: str, offset: int, size: int):
+        """Adds a named range of addresses which can be allocated from.
+
+        Args:
+            name: The name of the range (i.e. master)
+            offset: The offset of the range (its first address is the network address plus offset plus one)
+            size: The number of addresses in the range
+        """
+        if name in self._ranges:
+            raise Exception("Address range {} is already defined".format(name))
+        if size < 1:
+            raise Exception("Invalid address range {}: no free addresses follow offset {}, it overlaps with another "
+                            "range or a reserved address".format(name, offset))
+        if offset < 0 or offset + size >= self.subnet.num_addresses - 1:
+            raise Exception("Invalid address range {}: offset {} with size {} does not fit in {}".format(
+                name, offset, size, self.subnet))
+
+        mask = ((1 << size) - 1) << (offset + 1)
+        if mask & self._reserved:
+            raise Exception("Invalid address range {}: overlaps with a reserved address".format(name))
+        if mask & self._claimed:
+            others = [n for n, (o, s) in self._ranges.items() if mask & (((1 << s) - 1) << (o + 1))]
+            raise Exception("Invalid address range {}: overlaps with range(s) {}".format(name, ', '.join(others)))
+
+        self._claimed |= mask
+        self._ranges[name] = (offset, size)
+        self._allocated[name] = 0
+
+    def allocate(self, name: str, index: int) -> ipaddress.IPv4Address:
+        """Allocates the address for the node with the given index from the given range.
+
+        Args:
+            name: The name of the range to allocate from
+            index: The node's index number (starting at 1)
+
+        Returns:
+            The allocated address
+        """
+        offset, size = self._ranges[name]
+        if index < 1 or index > size:
+            raise Exception("Address range {} is exhausted: index {} exceeds its size of {}".format(name, index, size))
+        bit = 1 << (index - 1)
+        if self._allocated[name] & bit:
+            raise Exception("Address collision in range {}: index {} is already allocated".format(name, index))
+        self._allocated[name] |= bit
+        return self.subnet.network_address + offset + index
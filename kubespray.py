@@ -0,0 +1,205 @@
+"""A helper script for preparing the Kubespray workspace used to configure the cluster of the current stack.
+
+Rather than cloning Kubespray on every run, a pinned version of it is kept in a persistent cache directory along with a
+virtualenv containing its Python requirements. The version is set using glab:cluster.kubespray.version and the source
+is either a Git repository (which may be a local mirror) or a tarball (for air-gapped runners). The repository is
+mirrored into the cache and only fetched when the pinned version is not available yet. Each version is extracted once
+and each distinct set of requirements is installed into a virtualenv once, so repeat runs only need to copy the pristine
+source into the workspace. The cache may be shared by concurrent runs (i.e. deploy.py), so populating it is guarded
+by a lock file in the cache directory. Usage:
+
+    GLAB_OUTPUTS_FILE=outputs.json python kubespray.py WORKSPACE
+
+The workspace is recreated from the cached source on every run and contains a .venv link to the virtualenv.
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import urllib.request
+from typing import Any, Dict, Optional
+
+OUTPUTS_ENV = 'GLAB_OUTPUTS_FILE'
+
+DEFAULT_VERSION = 'v2.13.1'
+DEFAULT_REPOSITORY = 'https://github.com/kubernetes-sigs/kubespray.git'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'glab-deploy', 'kubespray')
+
+
+def git(*args: str, check: bool = True) -> subprocess.CompletedProcess:
+    """Runs git with the given arguments.
+
+    Args:
+        args: The arguments to pass to git
+        check: Whether to raise an exception if git exits with a non-zero status
+
+    Returns:
+        The completed git process
+    """
+    return subprocess.run(['git'] + list(args), check=check, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+class Workspace:
+    """Manages the cached source and virtualenv of a pinned Kubespray version."""
+
+    def __init__(self, version: str = DEFAULT_VERSION,
+                 repository: str = DEFAULT_REPOSITORY,
+                 tarball: Optional[str] = None,
+                 wheelhouse: Optional[str] = None,
+                 cache_dir: str = DEFAULT_CACHE_DIR):
+        """Initializes Workspace using the given parameters.
+
+        Args:
+            version: The Kubespray version (a tag, branch or commit) to use
+            repository: The Git repository (or a local mirror of it) Kubespray is fetched from
+            tarball: An optional path or URL to a tarball of the Kubespray source used instead of the repository
+            wheelhouse: An optional directory of wheels used to install the Python requirements without an index
+            cache_dir: The directory where the source and virtualenvs are cached
+        """
+        self.version = version
+        self.repository = repository
+        self.tarball = tarball
+        self.wheelhouse = wheelhouse
+        self.cache_dir = cache_dir
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]):
+        """Creates and returns a Workspace using the given configuration data.
+
+        Args:
+            config: The Kubespray configuration data (cluster['kubespray'])
+
+        Returns:
+            A Workspace object configured using the given configuration data
+        """
+        return Workspace(
+            version=config.get('version', DEFAULT_VERSION),
+            repository=config.get('repository', DEFAULT_REPOSITORY),
+            tarball=config.get('tarball'),
+            wheelhouse=config.get('wheelhouse'),
+            cache_dir=os.path.expanduser(config.get('cache_dir', DEFAULT_CACHE_DIR))
+        )
+
+    def _extract(self, target: str):
+        """Extracts the Kubespray source of the pinned version into the given (empty) directory."""
+        if self.tarball:
+            tarball = self.tarball
+            if tarball.startswith(('http://', 'https://')):
+                tarball = os.path.join(self.cache_dir, 'kubespray-{}.tar.gz'.format(self.version))
+                if not os.path.exists(tarball):
+                    print("Downloading {}...".format(self.tarball))
+                    urllib.request.urlretrieve(self.tarball, tarball + '.part')
+                    os.replace(tarball + '.part', tarball)
+            with tarfile.open(tarball) as tar:
+                members = tar.getmembers()
+                # Release tarballs contain a single top-level directory which is stripped
+                prefix = os.path.commonpath([m.name for m in members]) if len(members) > 1 else ''
+                for member in members:
+                    member.name = os.path.relpath(member.name, prefix) if prefix else member.name
+                    if member.name != '.':
+                        tar.extract(member, target)
+            return
+
+        mirror = os.path.join(self.cache_dir, 'mirror.git')
+        if not os.path.exists(mirror):
+            print("Mirroring {}...".format(self.repository))
+            git('clone', '--mirror', self.repository, mirror)
+        elif git('--git-dir', mirror, 'rev-parse', '--verify', '-q', self.version + '^{commit}',
+                 check=False).returncode:
+            print("Fetching {}...".format(self.repository))
+            git('--git-dir', mirror, 'fetch', '--prune', 'origin')
+
+        archive = subprocess.Popen(['git', '--git-dir', mirror, 'archive', '--format=tar', self.version],
+                                   stdout=subprocess.PIPE)
+        with tarfile.open(fileobj=archive.stdout, mode='r|') as tar:
+            tar.extractall(target)
+        if archive.wait():
+            raise Exception("Failed to archive Kubespray version {} from {}".format(self.version, self.repository))
+
+    def source(self) -> str:
+        """Returns the directory containing the pristine source of the pinned version, extracting it if necessary."""
+        path = os.path.join(self.cache_dir, 'src', self.version)
+        if not os.path.exists(path):
+            print("Extracting Kubespray {}...".format(self.version))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            target = tempfile.mkdtemp(dir=os.path.dirname(path))
+            try:
+                self._extract(target)
+                os.rename(target, path)
+            except OSError:
+                # Another run may have extracted the same version in the meantime
+                if not os.path.exists(path):
+                    raise
+            finally:
+                shutil.rmtree(target, ignore_errors=True)
+        return path
+
+    def virtualenv(self, source: str) -> str:
+        """Returns a virtualenv with the requirements of the given source installed, creating it if necessary.
+
+        Virtualenvs are keyed by the hash of the requirements file so versions with identical requirements share one.
+
+        Args:
+            source: The directory containing the Kubespray source
+
+        Returns:
+            The path to the virtualenv
+        """
+        with open(os.path.join(source, 'requirements.txt'), 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:16]
+        path = os.path.join(self.cache_dir, 'venv', digest)
+        marker = os.path.join(path, '.installed')
+        if not os.path.exists(marker):
+            print("Installing Kubespray requirements...")
+            shutil.rmtree(path, ignore_errors=True)
+            subprocess.run([sys.executable, '-m', 'venv', path], check=True)
+            pip = [os.path.join(path, 'bin', 'pip'), 'install', '-q']
+            if self.wheelhouse:
+                pip += ['--no-index', '--find-links', self.wheelhouse]
+            subprocess.run(pip + ['-r', os.path.join(source, 'requirements.txt')], check=True)
+            open(marker, 'w').close()
+        return path
+
+    def prepare(self, workspace: str):
+        """Recreates the given workspace from the cached source and links it to the cached virtualenv.
+
+        The cache is locked while the source and virtualenv are looked up (and populated if necessary), so concurrent
+        runs wait for each other instead of cloning, extracting or installing into the same directories.
+
+        Args:
+            workspace: The directory of the workspace
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            source = self.source()
+            venv = self.virtualenv(source)
+        shutil.rmtree(workspace, ignore_errors=True)
+        shutil.copytree(source, workspace, symlinks=True)
+        os.symlink(venv, os.path.join(workspace, '.venv'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('workspace', help='the directory of the workspace')
+    args = parser.parse_args()
+
+    path = os.environ.get(OUTPUTS_ENV)
+    if not path:
+        parser.error("{} must be set to a snapshot of the stack outputs (pulumi stack output --json)".format(
+            OUTPUTS_ENV))
+    with open(path, 'r') as f:
+        config = json.load(f)['cluster'].get('kubespray', {})
+
+    Workspace.from_config(config).prepare(args.workspace)
+
+
+if __name__ == '__main__':
+    main()
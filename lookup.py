@@ -0,0 +1,163 @@
+"""The InventoryLookup class used to resolve vSphere inventory objects through Pulumi data sources."""
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import pulumi_vsphere as vsphere
+
+from cache import InventoryCache
+
+DEFAULT_MAX_WORKERS = 8
+
+DATACENTER = 'datacenter'
+COMPUTE_CLUSTER = 'compute_cluster'
+HOST = 'host'
+DATASTORE = 'datastore'
+NETWORK = 'network'
+VIRTUAL_MACHINE = 'virtual_machine'
+
+# The properties of each kind of lookup result which are used by the program and therefore persisted when caching
+CACHED_PROPERTIES = {
+    DATACENTER: ['id'],
+    COMPUTE_CLUSTER: ['id', 'resource_pool_id'],
+    HOST: ['id', 'resource_pool_id'],
+    DATASTORE: ['id'],
+    NETWORK: ['id'],
+    VIRTUAL_MACHINE: ['id', 'guest_id', 'disks'],
+}
+
+
+class InventoryLookup:
+    """Resolves vSphere inventory objects (datacenters, hosts, datastores, etc.) concurrently.
+
+    Each data source lookup is a blocking invoke against vCenter. Rather than issuing them one after another, lookups
+    are submitted to a thread pool and a future is handed back to the caller. Lookups are also deduplicated: requesting
+    the same (datacenter, kind, name) combination more than once returns the future of the original request, so, for
+    example, pools sharing a datastore only cause a single invoke. The typical usage is to first submit every lookup
+    which is going to be needed and only then start resolving the results.
+
+    When an InventoryCache is given, lookups are first served from the cache and only the properties listed in
+    CACHED_PROPERTIES are available on the returned results. Anything resolved through vCenter is added to the cache.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, cache: Optional[InventoryCache] = None):
+        """Initializes InventoryLookup using the given parameters.
+
+        Args:
+            max_workers: The maximum number of lookups which will be in flight at any given time
+            cache: An optional InventoryCache used to avoid resolving static inventory through vCenter
+        """
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lookup',
+                                            initializer=_init_worker)
+        self._futures: Dict[Tuple[Optional[str], str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def _submit(self, datacenter_id: Optional[str], kind: str, name: str, fn: Callable[[], Any]) -> Future:
+        """Submits the given lookup function unless a lookup with the same key was already submitted.
+
+        Args:
+            datacenter_id: The id of the datacenter the object belongs to (None for datacenters themselves)
+            kind: The kind of object being looked up (i.e. datastore)
+            name: The name of the object as defined in vSphere
+            fn: The function which performs the actual lookup
+
+        Returns:
+            A future which resolves to the result of the lookup
+        """
+        key = (datacenter_id, kind, name)
+        with self._lock:
+            if key not in self._futures:
+                cached = self.cache.get(_cache_key(*key)) if self.cache else None
+                if cached is not None:
+                    self._futures[key] = Future()
+                    self._futures[key].set_result(SimpleNamespace(**cached))
+                else:
+                    self._futures[key] = self._executor.submit(self._resolve, key, fn)
+            return self._futures[key]
+
+    def _resolve(self, key: Tuple[Optional[str], str, str], fn: Callable[[], Any]) -> Any:
+        """Performs the given lookup function and stores its result in the cache (if one is configured).
+
+        Args:
+            key: The (datacenter, kind, name) key of the lookup
+            fn: The function which performs the actual lookup
+
+        Returns:
+            The result of the lookup
+        """
+        result = fn()
+        if self.cache:
+            value = {p: _to_json(getattr(result, p)) for p in CACHED_PROPERTIES[key[1]]}
+            with self._lock:
+                self.cache.put(_cache_key(*key), value)
+        return result
+
+    def datacenter(self, name: str) -> Future:
+        """Submits a lookup for the datacenter with the given name."""
+        return self._submit(None, DATACENTER, name, lambda: vsphere.get_datacenter(name))
+
+    def compute_cluster(self, datacenter_id: str, name: str) -> Future:
+        """Submits a lookup for the compute cluster with the given name in the given datacenter."""
+        return self._submit(datacenter_id, COMPUTE_CLUSTER, name,
+                            lambda: vsphere.get_compute_cluster(datacenter_id, name))
+
+    def host(self, datacenter_id: str, name: str) -> Future:
+        """Submits a lookup for the host with the given name in the given datacenter."""
+        return self._submit(datacenter_id, HOST, name, lambda: vsphere.get_host(datacenter_id, name))
+
+    def datastore(self, datacenter_id: str, name: str) -> Future:
+        """Submits a lookup for the datastore with the given name in the given datacenter."""
+        return self._submit(datacenter_id, DATASTORE, name,
+                            lambda: vsphere.get_datastore(datacenter_id, name=name))
+
+    def network(self, datacenter_id: str, name: str) -> Future:
+        """Submits a lookup for the network (port group) with the given name in the given datacenter."""
+        return self._submit(datacenter_id, NETWORK, name, lambda: vsphere.get_network(datacenter_id, name=name))
+
+    def virtual_machine(self, datacenter_id: str, name: str) -> Future:
+        """Submits a lookup for the virtual machine (or template) with the given name in the given datacenter."""
+        return self._submit(datacenter_id, VIRTUAL_MACHINE, name,
+                            lambda: vsphere.get_virtual_machine(datacenter_id, name=name))
+
+    def wait_all(self, futures: Dict[str, Future]):
+        """Waits for every given lookup and raises a single exception listing each lookup which failed.
+
+        Args:
+            futures: A dictionary mapping a description of each lookup (i.e. datastore vsan) to its future
+        """
+        wait(list(futures.values()))
+        failed = ['{}: {}'.format(d, f.exception()) for d, f in futures.items() if f.exception() is not None]
+        if failed:
+            raise Exception("Failed to resolve {} vSphere object(s):\n  {}".format(len(failed), '\n  '.join(failed)))
+
+    def shutdown(self, save: bool = True):
+        """Waits for any outstanding lookups and releases the underlying thread pool.
+
+        Args:
+            save: Whether to persist the cache (if one is configured) after all lookups have finished
+        """
+        self._executor.shutdown(wait=True)
+        if self.cache and save:
+            self.cache.save()
+
+
+def _init_worker():
+    """Gives each worker thread its own event loop since Pulumi schedules invokes on the calling thread's event loop."""
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+
+def _cache_key(datacenter_id: Optional[str], kind: str, name: str) -> str:
+    """Returns the key used to store a lookup with the given parameters in the cache."""
+    return '/'.join([datacenter_id or '', kind, name])
+
+
+def _to_json(value: Any) -> Any:
+    """Converts the given lookup result property into a JSON serializable value."""
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    if hasattr(value, 'items'):
+        return {k: _to_json(v) for k, v in value.items()}
+    return value
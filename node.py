@@ -1,20 +1,21 @@
 """The Node class and its helper classes and functions."""
-import base64
 from enum import Enum
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 import pulumi
 import pulumi_vsphere as vsphere
-from jinja2 import Template
 
 import environment
+import templates
+import tracing
 
 
-def _build_disks(template: vsphere.VirtualMachine) -> List[Dict[str, Any]]:
+def _build_disks(template: vsphere.VirtualMachine, linked: bool = False) -> List[Dict[str, Any]]:
     """Builds a list of disks based off of the disks present in the given virtual machine.
 
     Args:
         template: The virtual machine to copy disks from
+        linked: Whether the disks are used for a linked clone, in which case their sizes must match the template exactly
 
     Returns:
         A list of disks (in dictionary form) copied from the virtual machine
@@ -22,8 +23,11 @@ def _build_disks(template: vsphere.VirtualMachine) -> List[Dict[str, Any]]:
     i = 0
     disks = []
     for disk in template.disks:
+        size = int(float(str(disk['size'])))
+        if not linked:
+            size += 1  # Have to add 1 to account for rounding errors
         disks.append({'label': 'disk{}'.format(i),
-                      'size': int(float(str(disk['size']))) + 1,  # Have to add 1 to account for rounding errors
+                      'size': size,
                       'unitNumber': i,
                       'thinProvisioned': bool(disk['thinProvisioned']),
                       'eagerlyScrub': bool(disk['eagerlyScrub'])})
@@ -31,19 +35,19 @@ def _build_disks(template: vsphere.VirtualMachine) -> List[Dict[str, Any]]:
     return disks
 
 
-def _render_cloud_init(path: str, **kwargs) -> str:
-    """Renders a cloud-init Jinja2 template at the given path using the given keyword arguments.
+def hostname(settings: environment.NodeSettings, index: int, env_name: str) -> str:
+    """Generates the hostname of a node using the name format string of its node type.
 
     Args:
-        path: Path to the Jinja2 template
-        kwargs: Keyword arguments that will be passed to Jinja2 for rendering
+        settings: The settings of the node's type
+        index: The node's index number
+        env_name: The name of the environment the node is deployed in
 
     Returns:
-        The rendered template encoded with base64
+        The hostname of the node
     """
-    with open(path, 'r') as f:
-        rendered = Template(f.read()).render(**kwargs)
-    return base64.b64encode(rendered.encode('utf-8')).decode('utf-8')
+    index_str = index if index > 9 else '0' + str(index)
+    return settings.name.format(index=index_str, env=env_name)
 
 
 class NodeType(Enum):
@@ -55,16 +59,18 @@ class NodeType(Enum):
 class IPConfig:
     """An IP configuration used to configure a node's interfaces using cloud-init"""
 
-    def __init__(self, ip_address: str, gateway: str, dns_servers: List[str], domains: List[str]):
+    def __init__(self, ip_address: str, prefix_length: int, gateway: str, dns_servers: List[str], domains: List[str]):
         """ Initializes IPConfig using the given parameters.
 
         Args:
             ip_address: The IPv4 address to assign to the node
+            prefix_length: The prefix length of the subnet the address belongs to (i.e. 24)
             gateway: The IPv4 gateway to assign to the interface
             dns_servers: A list of DNS servers to assign to the interface
             domains: A list of default search domains to assign to the interface
         """
         self.ip_address = ip_address
+        self.prefix_length = prefix_length
         self.gateway = gateway
         self.dns_servers = dns_servers
         self.domains = domains
@@ -75,7 +81,7 @@ class IPConfig:
 
         The environment can give enough details to correctly configure a node's interface. The only information it
         cannot obtain is the node index which is required to determine the IPv4 address and the node's type which
-        determine the subnet and offset for the node's IPV4 address.
+        determines the address range the node's IPv4 address is allocated from.
 
         Args:
             index: The node's index number
@@ -85,13 +91,12 @@ class IPConfig:
         Returns:
             An IPConfig object configured using the given parameters and environment
         """
-        if node_type == NodeType.MASTER:
-            address = (env.network.subnet.network_address + env.master_config.network_offset + index)
-        else:
-            address = (env.network.subnet.network_address + env.worker_config.network_offset + index)
+        allocator = env.network.allocator
+        address = allocator.allocate('master' if node_type == NodeType.MASTER else 'worker', index)
         return IPConfig(
             ip_address=str(address),
-            gateway=str(env.network.subnet.network_address + 1),
+            prefix_length=allocator.prefix_length,
+            gateway=str(allocator.gateway),
             dns_servers=env.network.dns_servers,
             domains=env.network.domains
         )
@@ -103,8 +108,10 @@ class NodeProperties:
     def __init__(self, index: int,
                  node_type: NodeType,
                  resource_pool: environment.ResourcePool,
-                 vault_token: str,
-                 env: environment.Environment):
+                 vault_token: Optional[str],
+                 env: environment.Environment,
+                 host_keys: Optional[Dict[str, Dict[str, str]]] = None,
+                 depends_on: Optional[List[pulumi.Resource]] = None):
         """Initializes NodeProperties using the given parameters.
 
         Args:
@@ -113,6 +120,8 @@ class NodeProperties:
             resource_pool: The ResourcePool that the node will be created in
             vault_token: The Vault token that will be passed to cloud-init for signing SSH host keys on boot
             env: The environment to use when initializing the ode
+            host_keys: The SSH host keys signed at deploy time keyed by key type (if not given they're signed on boot)
+            depends_on: The resources which must be created before the node's virtual machine (used for rollouts)
         """
         self.index = index
         self.node_type = node_type
@@ -120,6 +129,8 @@ class NodeProperties:
         self.resource_pool = resource_pool
         self.vault_token = vault_token
         self.env = env
+        self.host_keys = host_keys
+        self.depends_on = depends_on
 
 
 class Node(pulumi.ComponentResource):
@@ -146,46 +157,73 @@ class Node(pulumi.ComponentResource):
             config = props.env.master_config
         else:
             config = props.env.worker_config
-        index_str = props.index if props.index > 9 else '0' + str(props.index)
-        name = config.name.format(index=index_str, env=props.env.name)
+        name = hostname(config, props.index, props.env.name)
         super().__init__('glab:deploy:node', "node-" + name, None, opts)
-
-        metadata = _render_cloud_init('files/metadata.yml.j2',
-                                      hostname=name,
-                                      ip_address=props.ip_config.ip_address,
-                                      gateway=props.ip_config.gateway,
-                                      dns_servers=props.ip_config.dns_servers,
-                                      domains=props.ip_config.domains)
-        userdata = _render_cloud_init('files/init.sh.j2',
-                                      vault_address=props.env.vault_address,
-                                      vault_token=props.vault_token)
-
+        self.hostname = name
+        self.ip_address = props.ip_config.ip_address
+        self.type = "master" if props.node_type == NodeType.MASTER else "worker"
+        self.resource_pool = props.resource_pool
+
+        encoding = props.env.cloud_init_encoding
+        with tracing.span('node.render', hostname=name):
+            metadata = templates.render_encoded('metadata.yml.j2',
+                                                encoding=encoding,
+                                                hostname=name,
+                                                ip_address=props.ip_config.ip_address,
+                                                prefix_length=props.ip_config.prefix_length,
+                                                gateway=props.ip_config.gateway,
+                                                dns_servers=props.ip_config.dns_servers,
+                                                domains=props.ip_config.domains)
+            ssh = props.env.ssh
+            userdata = templates.render_encoded('init.sh.j2',
+                                                encoding=encoding,
+                                                vault_address=props.env.vault_address,
+                                                vault_token=props.vault_token,
+                                                host_keys=props.host_keys,
+                                                key_types=ssh.key_types,
+                                                unused_key_types=[t for t in environment.KEY_TYPES
+                                                                  if t not in ssh.key_types],
+                                                sign_path=ssh.sign_path)
+        if props.host_keys:
+            # The user-data contains private keys so it must be encrypted in the stack state
+            userdata = pulumi.Output.secret(userdata)
+
+        # Prefer the template replica on the pool's datastore to avoid slow cross-datastore clones
+        template = props.resource_pool.template or props.env.node_template
+        linked = config.clone == environment.CLONE_LINKED
         self.vm = vsphere.VirtualMachine(
-            opts=pulumi.ResourceOptions(parent=self),
+            # The clone source and cloud-init data only matter when the virtual machine is created. The provider
+            # replaces virtual machines whose clone source changes, so existing nodes keep the template they were cloned
+            # from, and the user-data is cleared from guestinfo after the first boot, so it must not be written back
+            opts=pulumi.ResourceOptions(parent=self, depends_on=props.depends_on,
+                                        ignore_changes=['clone', 'extra_config']),
             name=name,
             resource_name="vm-" + name,
             resource_pool_id=props.resource_pool.id,
             num_cpus=config.cpus,
             memory=config.memory,
             datastore_id=props.resource_pool.datastore_id,
-            guest_id=props.env.node_template.guest_id,
-            disks=_build_disks(props.env.node_template),
+            guest_id=template.guest_id,
+            disks=_build_disks(template, linked=linked),
             clone={
-                'templateUuid': props.env.node_template.id
+                'templateUuid': template.id,
+                'linkedClone': linked,
             },
             network_interfaces=[{
                 'networkId': props.env.network.id
             }],
+            wait_for_guest_net_timeout=props.env.guest_net_timeout,
             extra_config={
                 'guestinfo.metadata': metadata,
-                'guestinfo.metadata.encoding': 'base64',
+                'guestinfo.metadata.encoding': encoding,
                 'guestinfo.userdata': userdata,
-                'guestinfo.userdata.encoding': 'base64',
+                'guestinfo.userdata.encoding': encoding,
             }
         )
 
         self.register_outputs({
-            "hostname": name,
-            "ip_address": props.ip_config.ip_address,
-            "type": "master" if props.node_type == NodeType.MASTER else "worker",
+            "hostname": self.hostname,
+            "ip_address": self.ip_address,
+            "type": self.type,
+            "pool": self.resource_pool.name,
         })
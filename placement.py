@@ -0,0 +1,126 @@
+"""The Scheduler class used to place nodes in the resource pools of an environment."""
+from collections import Counter
+from typing import Dict, Hashable, List, Tuple
+
+import environment
+
+
+def tier_key(pool: environment.ResourcePool) -> Tuple[bool, int]:
+    """Returns a key which sorts resource pools from the fastest to the slowest storage tier.
+
+    Pools without a tier are sorted after every pool with a tier.
+    """
+    return pool.tier is None, pool.tier or 0
+
+
+def select(candidates: List[Tuple[Hashable, environment.ResourcePool]], count: int) -> List[Hashable]:
+    """Selects the given number of candidates on the fastest storage tiers spread across failure domains.
+
+    Candidates are selected one at a time. Each time the candidates in the failure domains with the fewest selections so
+    far are preferred, followed by those on the fastest tier, and any remaining ties are resolved in favor of candidates
+    earlier in the list. This is used to choose the etcd members of a cluster.
+
+    Args:
+        candidates: A list of tuples of a candidate (i.e. a hostname) and the resource pool it's placed in
+        count: The number of candidates to select
+
+    Returns:
+        The selected candidates in the order they were selected
+    """
+    domains: Counter = Counter()
+    remaining = list(range(len(candidates)))
+    selected = []
+    while remaining and len(selected) < count:
+        chosen = min(remaining, key=lambda i: (domains[candidates[i][1].failure_domain], tier_key(candidates[i][1]), i))
+        remaining.remove(chosen)
+        candidate, pool = candidates[chosen]
+        domains[pool.failure_domain] += 1
+        selected.append(candidate)
+    return selected
+
+
+class Scheduler:
+    """Places nodes in resource pools proportional to the weight of each pool.
+
+    Placement uses a smooth weighted round-robin: every time a node is placed each eligible pool has its weight added to
+    a running score, the pool with the highest score is chosen and the sum of all eligible weights is subtracted from
+    its score. Over any run of placements each pool receives a share of nodes proportional to its weight while the
+    nodes of heavier pools are interleaved with the others rather than being handed out in bursts.
+
+    A pool is only eligible if it has enough CPU and memory capacity left for the node (pools without a configured
+    capacity are unbounded). When spreading is requested the candidates are further narrowed to the pools belonging to
+    the failure domains which have the fewest nodes in the same group so far, which is used to spread masters. The
+    candidates can also be restricted to the pools on the fastest storage tier among them, which is used to keep masters
+    on the fastest storage available in each failure domain.
+
+    Placement is deterministic and each group (i.e. masters and workers) keeps its own round-robin state. The pool of
+    the n-th node of a group therefore only depends on the nodes placed before it, so changing the number of nodes only
+    adds or removes nodes at the end without moving any of the existing ones.
+    """
+
+    def __init__(self, pools: List[environment.ResourcePool]):
+        """Initializes Scheduler using the given parameters.
+
+        Args:
+            pools: The resource pools to place nodes in (ties are resolved in favor of pools earlier in the list)
+        """
+        if not pools:
+            raise Exception("Must provide at least one resource pool for placing nodes")
+        for pool in pools:
+            if pool.weight <= 0:
+                raise Exception("Invalid weight for resource pool {}: {}. Must be greater than zero".format(
+                    pool.name, pool.weight))
+        self.pools = pools
+        self._scores: Dict[Hashable, List[int]] = {}
+        self._domains: Dict[Hashable, Counter] = {}
+        self._used_cpus = [0] * len(pools)
+        self._used_memory = [0] * len(pools)
+
+    def _fits(self, i: int, cpus: int, memory: int) -> bool:
+        """Returns whether a node with the given resources fits in the pool at the given index."""
+        pool = self.pools[i]
+        if pool.cpus is not None and self._used_cpus[i] + cpus > pool.cpus:
+            return False
+        if pool.memory is not None and self._used_memory[i] + memory > pool.memory:
+            return False
+        return True
+
+    def place(self, group: Hashable, cpus: int, memory: int, spread: bool = False,
+              fastest: bool = False) -> environment.ResourcePool:
+        """Chooses the resource pool for the next node of the given group and reserves its resources.
+
+        Args:
+            group: The group the node belongs to (i.e. its node type)
+            cpus: The number of CPUs the node is configured with
+            memory: The amount of memory in MB the node is configured with
+            spread: Whether to prefer pools in failure domains with the fewest nodes of this group
+            fastest: Whether to prefer pools on the fastest storage tier (applied after spreading)
+
+        Returns:
+            The resource pool the node should be created in
+        """
+        scores = self._scores.setdefault(group, [0] * len(self.pools))
+        domains = self._domains.setdefault(group, Counter())
+
+        eligible = [i for i in range(len(self.pools)) if self._fits(i, cpus, memory)]
+        if not eligible:
+            raise Exception("Insufficient capacity: no resource pool can fit a node with {} CPUs and {} MB of "
+                            "memory".format(cpus, memory))
+
+        candidates = eligible
+        if spread:
+            fewest = min(domains[self.pools[i].failure_domain] for i in eligible)
+            candidates = [i for i in eligible if domains[self.pools[i].failure_domain] == fewest]
+        if fastest:
+            best = min(tier_key(self.pools[i]) for i in candidates)
+            candidates = [i for i in candidates if tier_key(self.pools[i]) == best]
+
+        for i in eligible:
+            scores[i] += self.pools[i].weight
+        chosen = max(candidates, key=lambda i: (scores[i], -i))
+        scores[chosen] -= sum(self.pools[i].weight for i in eligible)
+
+        self._used_cpus[chosen] += cpus
+        self._used_memory[chosen] += memory
+        domains[self.pools[chosen].failure_domain] += 1
+        return self.pools[chosen]
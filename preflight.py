@@ -0,0 +1,347 @@
+"""Validation of the stack configuration which runs before any remote calls are made or resources are registered."""
+import ipaddress
+import string
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import cluster
+import environment
+import inv
+import node
+import placement
+import templates
+
+
+class Field:
+    """Describes a single value of the stack configuration."""
+
+    def __init__(self, types, required: bool = True, choices: Optional[List[Any]] = None,
+                 minimum: Optional[int] = None, schema: Optional[Dict[str, 'Field']] = None,
+                 items: Optional['Field'] = None):
+        """Initializes Field using the given parameters.
+
+        Args:
+            types: The type (or tuple of types) the value must be an instance of
+            required: Whether the value must be present
+            choices: An optional list of values the value must be one of
+            minimum: An optional minimum for numeric values (or the minimum length of lists)
+            schema: The fields of the value if it's a dictionary
+            items: The field every item must match if the value is a list
+        """
+        self.types = types
+        self.required = required
+        self.choices = choices
+        self.minimum = minimum
+        self.schema = schema
+        self.items = items
+
+
+def _optional(types, **kwargs) -> Field:
+    """Returns a Field for an optional value."""
+    return Field(types, required=False, **kwargs)
+
+
+NODE_SCHEMA = {
+    'name': Field(str),
+    'network_offset': Field(int, minimum=0),
+    'network_size': _optional(int, minimum=1),
+    'cpus': Field(int, minimum=1),
+    'memory': Field(int, minimum=1),
+    'clone': _optional(str, choices=environment.CLONE_MODES),
+}
+
+ENV_SCHEMA = {
+    'datacenter': Field(str),
+    'domain': Field(str),
+    'name': Field(str),
+    'template': Field(str),
+    'vault_address': Field(str),
+    'network': Field(dict, schema={
+        'name': Field(str),
+        'subnet': Field(str),
+        'dns_servers': Field(list, items=Field(str)),
+        'domains': Field(list, items=Field(str)),
+        'gateway': _optional(str),
+        'reserved': _optional(list, items=Field(str)),
+    }),
+    'node': Field(dict, schema={
+        'master': Field(dict, schema=NODE_SCHEMA),
+        'worker': Field(dict, schema=NODE_SCHEMA),
+    }),
+    'pools': Field(list, minimum=1, items=Field(dict, schema={
+        'type': Field(str),
+        'name': Field(str),
+        'datastore': Field(str),
+        'weight': Field((int, float)),
+        'failure_domain': _optional(str),
+        'tier': _optional(int, minimum=0),
+        'capacity': _optional(dict, schema={
+            'cpus': _optional(int, minimum=1),
+            'memory': _optional(int, minimum=1),
+        }),
+    })),
+    'cache': _optional(dict, schema={
+        'enabled': _optional(bool),
+        'ttl': _optional(int, minimum=0),
+        'path': _optional(str),
+    }),
+    'cloud_init_encoding': _optional(str, choices=templates.ENCODINGS),
+    'template_replicas': _optional(dict, schema={
+        'enabled': _optional(bool),
+        'source_datastore': _optional(str),
+        'name': _optional(str),
+    }),
+    'ssh': _optional(dict, schema={
+        'signing': _optional(str, choices=environment.SIGNING_MODES),
+        'key_types': _optional(list, minimum=1, items=Field(str, choices=environment.KEY_TYPES)),
+        'sign_path': _optional(str),
+    }),
+    'rollout': _optional(dict, schema={
+        'wave_size': _optional(int, minimum=1),
+        'max_per_pool': _optional(int, minimum=1),
+        'max_per_datastore': _optional(int, minimum=1),
+    }),
+    'guest_net_timeout': _optional(int, minimum=0),
+}
+
+CLUSTER_SCHEMA = {
+    'name': Field(str),
+    'nodes': Field(int, minimum=cluster.MINIMUM_NUM_NODES),
+    'masters': Field(int, minimum=1),
+    'state_reference': _optional(str),
+    'ansible': _optional(dict, schema={
+        'strategy': _optional(str, choices=inv.STRATEGIES),
+        'max_forks': _optional(int, minimum=1),
+        'mitogen_path': _optional(str),
+    }),
+    'kubespray': _optional(dict, schema={
+        'version': _optional(str),
+        'repository': _optional(str),
+        'tarball': _optional(str),
+        'wheelhouse': _optional(str),
+        'cache_dir': _optional(str),
+    }),
+    'downloads': _optional(dict, schema={
+        'enabled': _optional(bool),
+        'localhost': _optional(bool),
+        'cache_dir': _optional(str),
+        'registry_mirror': _optional(str),
+        'insecure_registry': _optional(bool),
+    }),
+}
+
+
+def check_schema(value: Any, field: Field, path: str, errors: List[str]):
+    """Checks the given value against the given field, appending a message to errors for every violation.
+
+    Args:
+        value: The value to check
+        field: The field describing the value
+        path: The path of the value used in messages (i.e. glab:env.network.subnet)
+        errors: The list of messages to append to
+    """
+    # bool is a subclass of int, so it must be rejected explicitly unless booleans are expected
+    if not isinstance(value, field.types) or (isinstance(value, bool) and field.types is not bool):
+        errors.append("{}: expected {} but got {}".format(path, _type_name(field.types), _type_name(type(value))))
+        return
+    if field.choices is not None and value not in field.choices:
+        errors.append("{}: {} is not one of {}".format(path, value, ', '.join(str(c) for c in field.choices)))
+    if field.minimum is not None:
+        size = len(value) if isinstance(value, list) else value
+        if size < field.minimum:
+            errors.append("{}: {} is less than the minimum of {}".format(
+                path, 'length' if isinstance(value, list) else value, field.minimum))
+
+    if field.schema is not None:
+        for key, child in field.schema.items():
+            if key in value:
+                check_schema(value[key], child, '{}.{}'.format(path, key), errors)
+            elif child.required:
+                errors.append("{}.{}: missing required value".format(path, key))
+        for key in value:
+            if key not in field.schema:
+                errors.append("{}.{}: unknown key".format(path, key))
+    if field.items is not None:
+        for i, item in enumerate(value):
+            check_schema(item, field.items, '{}[{}]'.format(path, i), errors)
+
+
+def _type_name(types) -> str:
+    """Returns a readable name of the given type (or tuple of types)."""
+    names = {str: 'string', int: 'integer', float: 'number', bool: 'boolean', list: 'list', dict: 'object'}
+    if isinstance(types, tuple):
+        return ' or '.join(names.get(t, t.__name__) for t in types)
+    return names.get(types, 'null' if types is type(None) else types.__name__)
+
+
+def check_name_format(value: str, path: str, errors: List[str]):
+    """Checks that the given node name format string only uses the index and env fields and uses the index field."""
+    try:
+        fields = {f for _, f, _, _ in string.Formatter().parse(value) if f is not None}
+    except ValueError as e:
+        errors.append("{}: invalid format string {}: {}".format(path, value, e))
+        return
+    unknown = fields - {'index', 'env'}
+    if unknown:
+        errors.append("{}: unknown field(s) {} in {}, only {{index}} and {{env}} are available".format(
+            path, ', '.join(sorted(unknown)), value))
+    if 'index' not in fields:
+        errors.append("{}: {} must contain {{index}} so that every node has a distinct name".format(path, value))
+
+
+def _contains(path: str, other: str) -> bool:
+    """Returns whether the value at the given path is or contains the value at the other path."""
+    return other == path or other.startswith(path + '.') or other.startswith(path + '[')
+
+
+def check_values(env_config: Dict[str, Any], cluster_config: Dict[str, Any], errors: List[str]):
+    """Checks the values of the configuration against each other.
+
+    Each check only runs when the sections of the configuration it depends on passed the schema check, so problems
+    in unrelated sections are still reported alongside schema errors.
+
+    Args:
+        env_config: The environment configuration data (glab:env)
+        cluster_config: The cluster configuration data (glab:cluster)
+        errors: The list of messages to append to, which already contains the schema errors
+    """
+    # Unknown keys are reported but don't prevent the values next to them from being checked
+    invalid = [e.split(': ', 1)[0] for e in errors if not e.endswith(': unknown key')]
+
+    def valid(*paths: str) -> bool:
+        """Returns whether none of the given paths, the values below them or the values above them failed the schema
+        check."""
+        return not any(_contains(i, p) or _contains(p, i) for i in invalid for p in paths)
+
+    counts = valid('glab:cluster.masters', 'glab:cluster.nodes')
+    masters = workers = 0
+    if counts:
+        masters = cluster_config['masters']
+        workers = cluster_config['nodes'] - masters
+        if workers < 0:
+            errors.append("glab:cluster.masters: {} exceeds the number of nodes ({})".format(
+                masters, cluster_config['nodes']))
+            counts = False
+
+    settings = {}
+    name_errors: List[str] = []
+    for node_type in ('master', 'worker'):
+        path = 'glab:env.node.{}'.format(node_type)
+        if not valid(path):
+            continue
+        config = env_config['node'][node_type]
+        check_name_format(config['name'], path + '.name', name_errors)
+        try:
+            settings[node_type] = environment.NodeSettings(
+                name=config['name'],
+                network_offset=config['network_offset'],
+                cpus=config['cpus'],
+                memory=config['memory'],
+                clone=config.get('clone', environment.CLONE_FULL),
+                network_size=config.get('network_size')
+            )
+        except Exception as e:
+            errors.append("{}: {}".format(path, e))
+    errors += name_errors
+    nodes = len(settings) == 2
+
+    # Every hostname must be unique across both node types
+    if nodes and counts and not name_errors and valid('glab:env.name'):
+        hostnames = Counter(node.hostname(settings['master'], i, env_config['name']) for i in range(1, masters + 1))
+        hostnames.update(node.hostname(settings['worker'], i, env_config['name']) for i in range(1, workers + 1))
+        duplicates = sorted(h for h, count in hostnames.items() if count > 1)
+        if duplicates:
+            errors.append("glab:env.node: the name formats produce duplicate hostnames: {}".format(
+                ', '.join(duplicates)))
+
+    # Claim the address ranges exactly like the environment does and make sure each range fits its nodes
+    if nodes and valid('glab:env.network'):
+        network_config = env_config['network']
+        try:
+            network = environment.Network(
+                network_id='',
+                subnet=ipaddress.ip_network(network_config['subnet']),
+                dns_servers=network_config['dns_servers'],
+                domains=network_config['domains'],
+                gateway=network_config.get('gateway'),
+                reserved=network_config.get('reserved')
+            )
+            for address in network_config['dns_servers']:
+                ipaddress.ip_address(address)
+            network.claim_ranges(settings['master'], settings['worker'])
+            if counts:
+                network.allocator.allocate('master', masters)
+                if workers:
+                    network.allocator.allocate('worker', workers)
+        except Exception as e:
+            errors.append("glab:env.network: {}".format(e))
+
+    # Place every node exactly like the cluster does to catch invalid weights and insufficient capacity
+    if valid('glab:env.pools'):
+        pools = []
+        seen = set()
+        for i, pool_config in enumerate(env_config['pools']):
+            key = (pool_config['type'].lower(), pool_config['name'])
+            if key[0] not in ('cluster', 'host'):
+                errors.append("glab:env.pools[{}].type: {} is not one of cluster, host".format(
+                    i, pool_config['type']))
+            elif key in seen:
+                errors.append("glab:env.pools[{}]: duplicate {} {}".format(i, *key))
+            seen.add(key)
+            capacity = pool_config.get('capacity', {})
+            pools.append(environment.ResourcePool(
+                id=pool_config['name'],
+                datastore_id=pool_config['datastore'],
+                weight=pool_config['weight'],
+                name=pool_config['name'],
+                datastore=pool_config['datastore'],
+                failure_domain=pool_config.get('failure_domain'),
+                cpus=capacity.get('cpus'),
+                memory=capacity.get('memory'),
+                tier=pool_config.get('tier')
+            ))
+        try:
+            pools.sort(key=lambda p: p.weight, reverse=True)
+            scheduler = placement.Scheduler(pools)
+            if nodes and counts:
+                for _ in range(masters):
+                    scheduler.place('master', settings['master'].cpus, settings['master'].memory, spread=True,
+                                    fastest=True)
+                for _ in range(workers):
+                    scheduler.place('worker', settings['worker'].cpus, settings['worker'].memory)
+        except Exception as e:
+            errors.append("glab:env.pools: {}".format(e))
+
+    if valid('glab:env.ssh'):
+        ssh_config = env_config.get('ssh', {})
+        try:
+            environment.SSHSettings(
+                signing=ssh_config.get('signing', environment.SIGNING_BOOT),
+                key_types=ssh_config.get('key_types')
+            )
+        except Exception as e:
+            errors.append("glab:env.ssh: {}".format(e))
+
+    replicas = env_config.get('template_replicas', {})
+    if valid('glab:env.template_replicas') and replicas.get('enabled', False) and 'source_datastore' not in replicas:
+        errors.append("glab:env.template_replicas.source_datastore: required when replicas are enabled")
+
+
+def validate(env_config: Dict[str, Any], cluster_config: Dict[str, Any]):
+    """Validates the whole stack configuration in a single local pass.
+
+    The configuration is first checked against a schema (required values, types, choices and minimums) and then its
+    values are checked against each other: node name formats, address ranges against the subnet and the node counts,
+    and whether every node can be placed in the resource pools. Every problem found is reported at once.
+
+    Args:
+        env_config: The environment configuration data (glab:env)
+        cluster_config: The cluster configuration data (glab:cluster)
+    """
+    errors: List[str] = []
+    check_schema(env_config, Field(dict, schema=ENV_SCHEMA), 'glab:env', errors)
+    check_schema(cluster_config, Field(dict, schema=CLUSTER_SCHEMA), 'glab:cluster', errors)
+    if isinstance(env_config, dict) and isinstance(cluster_config, dict):
+        check_values(env_config, cluster_config, errors)
+    if errors:
+        raise Exception("Invalid stack configuration:\n  {}".format('\n  '.join(errors)))
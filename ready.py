@@ -0,0 +1,127 @@
+"""A helper script which waits for the nodes of the current stack to finish booting before Kubespray configures them.
+
+Pulumi only waits for the guest network of each virtual machine to come up, while cloud-init may still be applying
+the network configuration or signing SSH host keys. Every node is probed over SSH for the status of cloud-init
+concurrently and the probes of nodes which are not ready yet are repeated with an exponential backoff. Nodes which are
+still not ready when the timeout expires, or on which cloud-init failed, are reported and the script exits with a
+non-zero status. The nodes are read from the snapshot of the stack outputs named by GLAB_OUTPUTS_FILE. Usage:
+
+    GLAB_OUTPUTS_FILE=outputs.json python ready.py [--hosts HOST,...] [--timeout SECONDS] [--user USER]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+OUTPUTS_ENV = 'GLAB_OUTPUTS_FILE'
+
+DEFAULT_TIMEOUT = 900
+DEFAULT_MAX_WORKERS = 32
+INITIAL_DELAY = 2
+MAX_DELAY = 30
+
+STATUS_DONE = 'done'
+STATUS_ERROR = 'error'
+STATUS_UNREACHABLE = 'unreachable'
+
+SSH_OPTIONS = ['-o', 'BatchMode=yes', '-o', 'ConnectTimeout=5', '-o', 'StrictHostKeyChecking=no', '-o',
+               'UserKnownHostsFile=/dev/null', '-o', 'LogLevel=ERROR']
+
+
+def probe(address: str, user: Optional[str] = None) -> str:
+    """Returns the status of cloud-init on the node with the given address.
+
+    Args:
+        address: The IP address of the node
+        user: The user to connect as (defaults to the SSH default)
+
+    Returns:
+        The status reported by cloud-init (i.e. running or done) or unreachable if the node could not be reached
+    """
+    target = '{}@{}'.format(user, address) if user else address
+    try:
+        result = subprocess.run(['ssh'] + SSH_OPTIONS + [target, 'cloud-init', 'status'], stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=30)
+    except subprocess.TimeoutExpired:
+        return STATUS_UNREACHABLE
+    if result.returncode == 255:
+        return STATUS_UNREACHABLE
+    for line in result.stdout.splitlines():
+        if line.startswith('status:'):
+            return line.split(':', 1)[1].strip()
+    return STATUS_UNREACHABLE
+
+
+def wait(hosts: Dict[str, str], timeout: int = DEFAULT_TIMEOUT, user: Optional[str] = None,
+         max_workers: int = DEFAULT_MAX_WORKERS) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Waits for cloud-init to finish on every given node.
+
+    Args:
+        hosts: A dictionary mapping the hostname of each node to its IP address
+        timeout: The number of seconds to wait for before giving up
+        user: The user to connect as (defaults to the SSH default)
+        max_workers: The maximum number of nodes probed concurrently
+
+    Returns:
+        A tuple of two dictionaries mapping the hostname of each failed node and of each node which was not ready in
+        time to its last status
+    """
+    deadline = time.monotonic() + timeout
+    delay = INITIAL_DELAY
+    pending = dict(hosts)
+    failed: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ready') as executor:
+        while True:
+            statuses = dict(zip(pending, executor.map(lambda a: probe(a, user), pending.values())))
+            for hostname, status in statuses.items():
+                if status == STATUS_DONE:
+                    del pending[hostname]
+                elif status == STATUS_ERROR:
+                    del pending[hostname]
+                    failed[hostname] = status
+
+            if not pending or time.monotonic() + delay > deadline:
+                return failed, {h: statuses[h] for h in pending}
+
+            print("Waiting for {} of {} nodes: {}".format(
+                len(pending), len(hosts), ', '.join('{} ({})'.format(h, statuses[h]) for h in sorted(pending))))
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_DELAY)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--hosts', help='comma separated list of hostnames to wait for (defaults to every node)')
+    parser.add_argument('--timeout', type=int, default=DEFAULT_TIMEOUT, help='the number of seconds to wait for')
+    parser.add_argument('--user', help='the user to connect to the nodes as')
+    parser.add_argument('--max-workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help='the maximum number of nodes probed concurrently')
+    args = parser.parse_args()
+
+    path = os.environ.get(OUTPUTS_ENV)
+    if not path:
+        parser.error("{} must be set to a snapshot of the stack outputs (pulumi stack output --json)".format(
+            OUTPUTS_ENV))
+    with open(path, 'r') as f:
+        cluster = json.load(f)['cluster']
+
+    names = args.hosts.split(',') if args.hosts else list(cluster['hosts'])
+    hosts = {n: cluster['hosts'][n]['ip_address'] for n in names}
+    start = time.monotonic()
+    failed, stragglers = wait(hosts, args.timeout, args.user, args.max_workers)
+
+    for hostname, status in sorted(failed.items()):
+        print("Node {} failed: cloud-init finished with status {}".format(hostname, status))
+    for hostname, status in sorted(stragglers.items()):
+        print("Node {} is not ready after {} seconds: last status was {}".format(hostname, args.timeout, status))
+    if failed or stragglers:
+        sys.exit(1)
+    print("All {} nodes ready after {:.0f} seconds".format(len(hosts), time.monotonic() - start))
+
+
+if __name__ == '__main__':
+    main()
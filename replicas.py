@@ -0,0 +1,64 @@
+"""A small helper script for creating the per-datastore template replicas configured for the current Pulumi stack.
+
+The vSphere provider used by Pulumi can only create powered on virtual machines, so replicas are instead created with
+govc: the template is cloned (powered off) to each datastore which needs a replica, a single snapshot is taken so that
+the replica can be used for linked clones and the clone is then marked as a template. Replicas which already exist are
+left untouched, so this script only does work the first time a datastore is added to the environment.
+
+The govc connection settings default to the VSPHERE_SERVER, VSPHERE_USER and VSPHERE_PASSWORD environment variables.
+The stack is the selected one unless its name is passed as the only argument. Usage:
+
+    python replicas.py [STACK]
+"""
+import json
+import os
+import subprocess
+import sys
+
+import environment
+
+
+def govc(*args: str, check: bool = True) -> subprocess.CompletedProcess:
+    """Runs govc with the given arguments.
+
+    Args:
+        args: The arguments to pass to govc
+        check: Whether to raise an exception if govc exits with a non-zero status
+
+    Returns:
+        The completed govc process
+    """
+    return subprocess.run(['govc'] + list(args), check=check, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+for var, default in [('GOVC_URL', 'VSPHERE_SERVER'), ('GOVC_USERNAME', 'VSPHERE_USER'),
+                     ('GOVC_PASSWORD', 'VSPHERE_PASSWORD')]:
+    if var not in os.environ and default in os.environ:
+        os.environ[var] = os.environ[default]
+
+stack = ['--stack', sys.argv[1]] if len(sys.argv) > 1 else []
+config = json.loads(subprocess.check_output(['pulumi', 'config', 'get', 'env'] + stack, universal_newlines=True))
+if not config.get('template_replicas', {}).get('enabled', False):
+    sys.exit(0)
+
+os.environ['GOVC_DATACENTER'] = config['datacenter']
+for datastore in environment.replica_datastores(config):
+    name = environment.replica_name(config, datastore)
+
+    # vm.info exits successfully but prints nothing when the virtual machine does not exist
+    if govc('vm.info', name).stdout.strip():
+        print("Template replica {} already exists".format(name))
+        continue
+
+    # Place the replica in the first pool which uses the datastore
+    pool = next(p for p in config['pools'] if p['datastore'] == datastore)
+    if pool['type'].lower() == 'cluster':
+        placement = ['-pool', '{}/Resources'.format(pool['name'])]
+    else:
+        placement = ['-host', pool['name']]
+
+    print("Creating template replica {} on datastore {}...".format(name, datastore))
+    govc('vm.clone', '-vm', config['template'], '-ds', datastore, '-on=false', *placement, name)
+    govc('snapshot.create', '-vm', name, 'base')
+    govc('vm.markastemplate', name)
@@ -0,0 +1,72 @@
+"""The Rollout class used to order the creation of the virtual machines of a cluster."""
+from typing import Dict, List
+
+import pulumi
+
+import environment
+
+
+class Rollout:
+    """Orders the creation of virtual machines into waves and caps how many are cloned concurrently.
+
+    Pulumi creates every resource whose dependencies are satisfied at the same time, so the only way to shape a rollout
+    is through dependencies. The masters form the first wave and the workers follow in waves of a fixed size, where each
+    virtual machine of a wave depends on every virtual machine of the previous wave. In addition, the n-th virtual
+    machine of a resource pool depends on the (n - max_per_pool)-th virtual machine of the same pool, which splits the
+    virtual machines of a pool into max_per_pool chains and therefore never has more than max_per_pool of them being
+    cloned at once. The same is done for the virtual machines on each datastore using max_per_datastore.
+
+    Dependencies only affect the order in which resources are created (and deleted), so existing virtual machines are
+    unaffected by a change to the rollout settings.
+    """
+
+    def __init__(self, settings: environment.RolloutSettings):
+        """Initializes Rollout using the given parameters.
+
+        Args:
+            settings: The rollout settings of the environment
+        """
+        self.settings = settings
+        self._waves: Dict[int, List[pulumi.Resource]] = {}
+        self._pools: Dict[str, List[pulumi.Resource]] = {}
+        self._datastores: Dict[str, List[pulumi.Resource]] = {}
+        self._workers = 0
+
+    def _wave(self, master: bool) -> int:
+        """Returns the index of the wave the next master or worker belongs to."""
+        if master:
+            return 0
+        if not self.settings.wave_size:
+            return 1
+        return 1 + self._workers // self.settings.wave_size
+
+    def depends_on(self, pool: environment.ResourcePool, master: bool) -> List[pulumi.Resource]:
+        """Returns the resources the virtual machine of the next node must wait for before it's created.
+
+        Args:
+            pool: The resource pool the node is placed in
+            master: Whether the node is a master
+
+        Returns:
+            A list of resources the node's virtual machine depends on
+        """
+        dependencies = list(self._waves.get(self._wave(master) - 1, []))
+        for resources, limit in [(self._pools.get(pool.id, []), self.settings.max_per_pool),
+                                 (self._datastores.get(pool.datastore_id, []), self.settings.max_per_datastore)]:
+            if limit and len(resources) >= limit and resources[-limit] not in dependencies:
+                dependencies.append(resources[-limit])
+        return dependencies
+
+    def add(self, pool: environment.ResourcePool, master: bool, resource: pulumi.Resource):
+        """Records the virtual machine created for the next node.
+
+        Args:
+            pool: The resource pool the node is placed in
+            master: Whether the node is a master
+            resource: The virtual machine of the node
+        """
+        self._waves.setdefault(self._wave(master), []).append(resource)
+        self._pools.setdefault(pool.id, []).append(resource)
+        self._datastores.setdefault(pool.datastore_id, []).append(resource)
+        if not master:
+            self._workers += 1
@@ -0,0 +1,79 @@
+"""A shared Jinja2 rendering engine for the templates stored in the files directory.
+
+Every template is loaded through a single Jinja2 environment so it is only compiled once per program run. Compiled
+bytecode is additionally persisted with a bytecode cache so that subsequent runs can skip parsing entirely. Since many
+nodes render identical content (i.e. the cloud-init user-data) the rendered and encoded output is memoized as well.
+"""
+import base64
+import functools
+import gzip
+import json
+import os
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'files')
+
+ENCODING_BASE64 = 'base64'
+ENCODING_GZIP_BASE64 = 'gzip+base64'
+ENCODINGS = (ENCODING_BASE64, ENCODING_GZIP_BASE64)
+
+_environment = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    bytecode_cache=FileSystemBytecodeCache(),
+)
+
+
+def encode(content: str, encoding: str = ENCODING_BASE64) -> str:
+    """Encodes the given content using one of the encodings supported by the cloud-init guestinfo datasource.
+
+    Args:
+        content: The content to encode
+        encoding: The encoding to use, either base64 or gzip+base64
+
+    Returns:
+        The encoded content
+    """
+    data = content.encode('utf-8')
+    if encoding == ENCODING_GZIP_BASE64:
+        # A fixed mtime keeps the output deterministic so that Pulumi does not see a diff on every run
+        data = gzip.compress(data, compresslevel=9, mtime=0)
+    elif encoding != ENCODING_BASE64:
+        raise Exception("Invalid encoding: {}. Must be one of: {}".format(encoding, ', '.join(ENCODINGS)))
+    return base64.b64encode(data).decode('utf-8')
+
+
+def render(name: str, **kwargs) -> str:
+    """Renders the template with the given name (relative to the files directory) using the given keyword arguments.
+
+    Args:
+        name: The name of the template (i.e. init.sh.j2)
+        kwargs: Keyword arguments that will be passed to Jinja2 for rendering
+
+    Returns:
+        The rendered template
+    """
+    return _environment.get_template(name).render(**kwargs)
+
+
+def render_encoded(name: str, encoding: str = ENCODING_BASE64, **kwargs) -> str:
+    """Renders the template with the given name and encodes the result using the given encoding.
+
+    Results are memoized, so rendering the same template with the same arguments is only done once per program run.
+
+    Args:
+        name: The name of the template (i.e. init.sh.j2)
+        encoding: The encoding to use, either base64 or gzip+base64
+        kwargs: Keyword arguments that will be passed to Jinja2 for rendering
+
+    Returns:
+        The rendered template encoded with the given encoding
+    """
+    # The arguments are serialized into a canonical form so that they can be used as the memoization key
+    return _render_encoded(name, encoding, json.dumps(kwargs, sort_keys=True))
+
+
+@functools.lru_cache(maxsize=None)
+def _render_encoded(name: str, encoding: str, serialized_kwargs: str) -> str:
+    """The memoized implementation of render_encoded."""
+    return encode(render(name, **json.loads(serialized_kwargs)), encoding)
@@ -0,0 +1,125 @@
+import ipaddress
+
+import pytest
+
+from ipam import IPAllocator, parse_range
+
+SUBNET = ipaddress.ip_network('192.168.1.0/24')
+
+
+def test_parse_range():
+    assert parse_range(SUBNET, '192.168.1.10-192.168.1.20') == (10, 20)
+    assert parse_range(SUBNET, '192.168.1.5') == (5, 5)
+
+
+@pytest.mark.parametrize('value', ['192.168.2.1', '192.168.1.20-192.168.1.10', '192.168.1.250-192.168.2.5'])
+def test_parse_range_rejects_invalid_ranges(value):
+    with pytest.raises(Exception, match='Invalid address range'):
+        parse_range(SUBNET, value)
+
+
+def test_allocate_by_index():
+    allocator = IPAllocator(SUBNET)
+    allocator.add_range('master', 10, 5)
+    assert allocator.allocate('master', 1) == ipaddress.ip_address('192.168.1.11')
+    assert allocator.allocate('master', 5) == ipaddress.ip_address('192.168.1.15')
+    assert allocator.prefix_length == 24
+
+
+def test_allocating_an_index_twice_is_a_collision():
+    allocator = IPAllocator(SUBNET)
+    allocator.add_range('master', 10, 5)
+    allocator.allocate('master', 2)
+    with pytest.raises(Exception, match='Address collision'):
+        allocator.allocate('master', 2)
+
+
+def test_range_exhaustion():
+    allocator = IPAllocator(SUBNET)
+    allocator.add_range('worker', 20, 3)
+    for index in range(1, 4):
+        allocator.allocate('worker', index)
+    with pytest.raises(Exception, match='exhausted'):
+        allocator.allocate('worker', 4)
+    with pytest.raises(Exception, match='exhausted'):
+        allocator.allocate('worker', 0)
+
+
+def test_overlapping_ranges_are_rejected():
+    allocator = IPAllocator(SUBNET)
+    allocator.add_range('master', 10, 10)
+    with pytest.raises(Exception, match='overlaps with range\\(s\\) master'):
+        allocator.add_range('worker', 15, 10)
+    # Adjacent ranges don't overlap
+    allocator.add_range('worker', 20, 10)
+
+
+def test_duplicate_range_names_are_rejected():
+    allocator = IPAllocator(SUBNET)
+    allocator.add_range('master', 10, 5)
+    with pytest.raises(Exception, match='already defined'):
+        allocator.add_range('master', 50, 5)
+
+
+def test_default_gateway_is_reserved():
+    allocator = IPAllocator(SUBNET)
+    assert allocator.gateway == ipaddress.ip_address('192.168.1.1')
+    with pytest.raises(Exception, match='reserved address'):
+        allocator.add_range('master', 0, 5)
+
+
+def test_custom_gateway_is_reserved():
+    allocator = IPAllocator(SUBNET, gateway='192.168.1.254')
+    allocator.add_range('master', 0, 5)
+    assert allocator.max_size(100) == 153
+    with pytest.raises(Exception, match='reserved address'):
+        allocator.add_range('worker', 250, 4)
+
+
+def test_gateway_outside_subnet_is_rejected():
+    with pytest.raises(Exception, match='Invalid gateway'):
+        IPAllocator(SUBNET, gateway='192.168.2.1')
+
+
+def test_reserved_ranges():
+    allocator = IPAllocator(SUBNET, reserved=['192.168.1.50-192.168.1.59', '192.168.1.100'])
+    assert allocator.max_size(10) == 39
+    assert allocator.max_size(59) == 40
+    with pytest.raises(Exception, match='reserved address'):
+        allocator.add_range('master', 45, 10)
+    with pytest.raises(Exception, match='reserved address'):
+        allocator.add_range('worker', 99, 1)
+    allocator.add_range('master', 10, 39)
+    allocator.add_range('worker', 59, 40)
+
+
+def test_max_size_at_the_subnet_edge():
+    allocator = IPAllocator(SUBNET)
+    # Only the broadcast address follows the range
+    assert allocator.max_size(200) == 54
+    assert allocator.max_size(253) == 1
+    assert allocator.max_size(254) == 0
+    allocator.add_range('worker', 200, 54)
+    assert allocator.allocate('worker', 54) == ipaddress.ip_address('192.168.1.254')
+
+
+def test_range_past_the_subnet_edge_is_rejected():
+    allocator = IPAllocator(SUBNET)
+    with pytest.raises(Exception, match='does not fit'):
+        allocator.add_range('worker', 200, 55)
+    with pytest.raises(Exception, match='no free addresses'):
+        allocator.add_range('master', 254, allocator.max_size(254))
+
+
+def test_max_size_stops_at_claimed_ranges():
+    allocator = IPAllocator(SUBNET)
+    allocator.add_range('worker', 100, 20)
+    assert allocator.max_size(10) == 90
+    assert allocator.max_size(120) == 134
+
+
+def test_small_subnets():
+    allocator = IPAllocator(ipaddress.ip_network('10.0.0.0/30'))
+    assert allocator.max_size(1) == 1
+    with pytest.raises(Exception, match='Invalid subnet'):
+        IPAllocator(ipaddress.ip_network('10.0.0.0/31'))
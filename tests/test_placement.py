@@ -0,0 +1,119 @@
+from collections import Counter
+
+import pytest
+
+import environment
+import placement
+
+
+def make_pool(name, weight=1, **kwargs):
+    return environment.ResourcePool(id=name, datastore_id=name + '-ds', weight=weight, name=name, **kwargs)
+
+
+def place_all(scheduler, count, group='worker', cpus=2, memory=4096, **kwargs):
+    return [scheduler.place(group, cpus, memory, **kwargs).name for _ in range(count)]
+
+
+def test_placement_is_proportional_to_weight():
+    pools = [make_pool('a', 2), make_pool('b'), make_pool('c')]
+    counts = Counter(place_all(placement.Scheduler(pools), 1000))
+    assert counts == {'a': 500, 'b': 250, 'c': 250}
+
+
+def test_placement_interleaves_pools():
+    pools = [make_pool('a', 2), make_pool('b'), make_pool('c')]
+    names = place_all(placement.Scheduler(pools), 1000)
+    # Every window of four consecutive placements matches the 2:1:1 weights
+    for i in range(0, len(names), 4):
+        assert Counter(names[i:i + 4]) == {'a': 2, 'b': 1, 'c': 1}
+
+
+def test_placement_with_uneven_weights_over_large_counts():
+    pools = [make_pool('a', 5), make_pool('b', 3), make_pool('c', 2)]
+    counts = Counter(place_all(placement.Scheduler(pools), 5000))
+    assert counts == {'a': 2500, 'b': 1500, 'c': 1000}
+
+
+def test_exhausted_pool_overflows_to_other_pools():
+    pools = [make_pool('a', 2, cpus=20), make_pool('b'), make_pool('c')]
+    counts = Counter(place_all(placement.Scheduler(pools), 1000))
+    assert counts['a'] == 10
+    assert counts['b'] + counts['c'] == 990
+    assert abs(counts['b'] - counts['c']) <= 1
+
+
+def test_memory_capacity_is_respected():
+    pools = [make_pool('a', memory=4096 * 3), make_pool('b', memory=4096 * 100)]
+    counts = Counter(place_all(placement.Scheduler(pools), 50))
+    assert counts == {'a': 3, 'b': 47}
+
+
+def test_insufficient_capacity():
+    pools = [make_pool('a', cpus=4), make_pool('b', cpus=2)]
+    scheduler = placement.Scheduler(pools)
+    place_all(scheduler, 3)
+    with pytest.raises(Exception, match='Insufficient capacity'):
+        scheduler.place('worker', 2, 4096)
+
+
+def test_node_larger_than_every_pool():
+    scheduler = placement.Scheduler([make_pool('a', cpus=8, memory=8192)])
+    with pytest.raises(Exception, match='Insufficient capacity'):
+        scheduler.place('master', 16, 4096)
+
+
+def test_capacity_is_shared_between_groups():
+    scheduler = placement.Scheduler([make_pool('a', cpus=4), make_pool('b')])
+    # The masters are spread over both pools, leaving room for a single worker in a
+    assert place_all(scheduler, 2, group='master', spread=True) == ['a', 'b']
+    assert Counter(place_all(scheduler, 40)) == {'a': 1, 'b': 39}
+
+
+def test_masters_spread_across_failure_domains():
+    pools = [make_pool('a1', 4, failure_domain='a'), make_pool('a2', 4, failure_domain='a'),
+             make_pool('b1', 1, failure_domain='b'), make_pool('c1', 1, failure_domain='c')]
+    scheduler = placement.Scheduler(pools)
+    masters = [scheduler.place('master', 4, 8192, spread=True) for _ in range(3)]
+    assert {p.failure_domain for p in masters} == {'a', 'b', 'c'}
+
+    masters += [scheduler.place('master', 4, 8192, spread=True) for _ in range(3)]
+    assert Counter(p.failure_domain for p in masters) == {'a': 2, 'b': 2, 'c': 2}
+
+
+def test_masters_do_not_affect_worker_distribution():
+    pools = [make_pool('a', 2), make_pool('b'), make_pool('c')]
+    scheduler = placement.Scheduler(pools)
+    place_all(scheduler, 3, group='master', spread=True)
+    assert Counter(place_all(scheduler, 1000)) == {'a': 500, 'b': 250, 'c': 250}
+
+
+def test_fastest_tier_is_preferred_for_masters():
+    pools = [make_pool('slow', 4, tier=1), make_pool('fast', 1, tier=0), make_pool('untiered', 4)]
+    scheduler = placement.Scheduler(pools)
+    assert set(place_all(scheduler, 3, group='master', fastest=True)) == {'fast'}
+
+
+@pytest.mark.parametrize('count,extra', [(10, 1), (100, 50), (1000, 500)])
+def test_placement_is_stable_when_the_count_grows(count, extra):
+    def placements(n):
+        pools = [make_pool('a', 3, cpus=1000), make_pool('b', 2, failure_domain='x'), make_pool('c', 1)]
+        scheduler = placement.Scheduler(pools)
+        masters = place_all(scheduler, 3, group='master', spread=True)
+        return masters, place_all(scheduler, n)
+
+    masters, workers = placements(count)
+    grown_masters, grown_workers = placements(count + extra)
+    assert grown_masters == masters
+    assert grown_workers[:count] == workers
+
+
+def test_invalid_weight():
+    with pytest.raises(Exception, match='Invalid weight'):
+        placement.Scheduler([make_pool('a', 0)])
+
+
+def test_select_spreads_etcd_members_across_failure_domains():
+    pools = [make_pool('a', failure_domain='x', tier=1), make_pool('b', failure_domain='x', tier=0),
+             make_pool('c', failure_domain='y', tier=1)]
+    candidates = [('node1', pools[0]), ('node2', pools[1]), ('node3', pools[2]), ('node4', pools[1])]
+    assert placement.select(candidates, 3) == ['node2', 'node3', 'node4']
@@ -0,0 +1,193 @@
+"""Helpers for recording phase-level timing spans of a deployment and reporting on them.
+
+Spans are appended as Chrome trace events (one JSON object per line) to the file named by the GLAB_TRACE_FILE
+environment variable, which allows both the Pulumi program and up.sh to record spans in the same file. When the
+variable is not set recording a span is a no-op. Once a deployment has finished the recorded spans, along with the
+per-resource create durations found in a Pulumi event log, are combined into a single trace file which can be loaded
+in chrome://tracing (or https://ui.perfetto.dev) and a summary table is printed. Usage:
+
+    python tracing.py report EVENTS OUTPUT [--pulumi-events FILE]
+"""
+import argparse
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+TRACE_ENV = 'GLAB_TRACE_FILE'
+
+_lock = threading.Lock()
+
+
+def record(name: str, start: float, end: float, category: str = 'program', **args):
+    """Records a span with the given start and end times.
+
+    Args:
+        name: The name of the span (i.e. environment.from_config)
+        start: The start time of the span in seconds since the epoch
+        end: The end time of the span in seconds since the epoch
+        category: The category of the span
+        args: Additional arguments attached to the span (i.e. the hostname of a node)
+    """
+    path = os.environ.get(TRACE_ENV)
+    if not path:
+        return
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': int(start * 1e6),
+        'dur': int((end - start) * 1e6),
+        'pid': os.getpid(),
+        'tid': threading.get_ident() % (2 ** 31),
+        'args': args,
+    }
+    with _lock, open(path, 'a') as f:
+        f.write(json.dumps(event) + '\n')
+
+
+@contextlib.contextmanager
+def span(name: str, category: str = 'program', **args):
+    """A context manager which records a span covering the body of the with statement.
+
+    Args:
+        name: The name of the span (i.e. environment.from_config)
+        category: The category of the span
+        args: Additional arguments attached to the span (i.e. the hostname of a node)
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(name, start, time.time(), category, **args)
+
+
+def load_events(path: str) -> List[Dict[str, Any]]:
+    """Loads the spans recorded in the given file.
+
+    Args:
+        path: The file the spans were recorded to
+
+    Returns:
+        A list of Chrome trace events
+    """
+    events = []
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    events.append(json.loads(line))
+    return events
+
+
+def load_pulumi_events(path: str) -> List[Dict[str, Any]]:
+    """Converts the resource operations found in a Pulumi event log (pulumi up --event-log) into spans.
+
+    Each span starts with the resource's pre event and ends with its outputs (or failure) event. Only operations which
+    modify a resource are included.
+
+    Args:
+        path: The Pulumi event log
+
+    Returns:
+        A list of Chrome trace events
+    """
+    starts: Dict[str, Any] = {}
+    events = []
+    if not os.path.exists(path):
+        return events
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            for kind in ('resourcePreEvent', 'resOutputsEvent', 'resOpFailedEvent'):
+                if kind not in event:
+                    continue
+                metadata = event[kind]['metadata']
+                if metadata['op'] in ('same', 'read', 'refresh') or event[kind].get('planning'):
+                    continue
+                urn = metadata['urn']
+                if kind == 'resourcePreEvent':
+                    starts[urn] = event['timestamp']
+                elif urn in starts:
+                    start = starts.pop(urn)
+                    events.append({
+                        'name': 'pulumi.{}'.format(metadata['op']),
+                        'cat': 'pulumi',
+                        'ph': 'X',
+                        'ts': int(start * 1e6),
+                        'dur': int((event['timestamp'] - start) * 1e6),
+                        'pid': 0,
+                        'tid': len(events),
+                        'args': {
+                            'urn': urn,
+                            'type': metadata['type'],
+                            'failed': kind == 'resOpFailedEvent',
+                        },
+                    })
+    return events
+
+
+def summarize(events: List[Dict[str, Any]]) -> str:
+    """Builds a summary table of the given spans grouped by name.
+
+    Args:
+        events: A list of Chrome trace events
+
+    Returns:
+        The summary table
+    """
+    groups: Dict[str, List[int]] = OrderedDict()
+    for event in sorted(events, key=lambda e: e['ts']):
+        name = event['name']
+        if event['cat'] == 'pulumi':
+            name = '{} {}'.format(name, event['args']['type'].split(':')[-1])
+        groups.setdefault(name, []).append(event['dur'])
+
+    lines = ["{:<50} {:>6} {:>10} {:>10}".format('phase', 'count', 'total', 'max')]
+    for name, durations in groups.items():
+        lines.append("{:<50} {:>6} {:>9.2f}s {:>9.2f}s".format(
+            name, len(durations), sum(durations) / 1e6, max(durations) / 1e6))
+    return '\n'.join(lines)
+
+
+def report(events_path: str, output_path: str, pulumi_events_path: Optional[str] = None) -> str:
+    """Combines the recorded spans and Pulumi events into a Chrome trace file and returns a summary of them.
+
+    Args:
+        events_path: The file the spans were recorded to
+        output_path: The Chrome trace file to write
+        pulumi_events_path: An optional Pulumi event log to include
+
+    Returns:
+        The summary table
+    """
+    events = load_events(events_path)
+    if pulumi_events_path:
+        events += load_pulumi_events(pulumi_events_path)
+    with open(output_path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    return summarize(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    report_parser = subparsers.add_parser('report', help='write a Chrome trace file and print a summary table')
+    report_parser.add_argument('events', help='the file spans were recorded to')
+    report_parser.add_argument('output', help='the Chrome trace file to write')
+    report_parser.add_argument('--pulumi-events', help='a Pulumi event log (pulumi up --event-log) to include')
+    args = parser.parse_args()
+
+    if args.command == 'report':
+        print(report(args.events, args.output, args.pulumi_events))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,26 @@ function help {
     echo ""
     echo "Flags:"
     echo "  --only-provision  Skips bringing up infrastructure and only runs Kubespray provisioner"
+    echo "  --only-infrastructure  Only brings up infrastructure and skips the Kubespray provisioner"
+    echo "  --refresh         Ignores the local vSphere inventory cache and resolves everything through vCenter again"
+    echo "  --scale           Only configures the workers which Kubespray has not configured yet using Kubespray scale.yml"
+}
+
+declare -A span_starts
+
+function spanStart {
+    span_starts[$1]=$(date +%s%6N)
+}
+
+function spanEnd {
+    local end
+    end=$(date +%s%6N)
+    echo "{\"name\": \"$1\", \"cat\": \"up.sh\", \"ph\": \"X\", \"ts\": ${span_starts[$1]}, \"dur\": $((end - span_starts[$1])), \"pid\": $$, \"tid\": 0, \"args\": {}}" >> "${GLAB_TRACE_FILE}"
+}
+
+function report {
+    echo "Writing trace to ${trace_dir}/trace.json..."
+    python tracing.py report "${GLAB_TRACE_FILE}" "${trace_dir}/trace.json" --pulumi-events "${trace_dir}/pulumi-events.jsonl"
 }
 
 function checkForError {
@@ -19,37 +39,162 @@ if [[ -z "$1" ]]; then
     exit 1
 fi
 
-if [[ ! $(pulumi stack --show-name) == "$1" ]]; then
-    echo "Changing to stack $1..."
-    pulumi stack select $1
-    checkForError $? "invalid Stack specified"
+# The stack is passed to every Pulumi command rather than selected so that several stacks can be deployed at once
+stack=$1
+
+trace_dir=".trace/${stack}"
+mkdir -p "${trace_dir}"
+# A trace file set by the caller (i.e. deploy.py running the phases separately) is appended to rather than reset
+if [[ -z "${GLAB_TRACE_FILE}" ]]; then
+    rm -f "${trace_dir}"/*.json*
+    export GLAB_TRACE_FILE="${trace_dir}/events.jsonl"
 fi
+trap report EXIT
+
+only_provision=false
+only_infrastructure=false
+scale=false
+for arg in "${@:2}"; do
+    case ${arg} in
+        --only-provision)
+            only_provision=true
+            ;;
+        --only-infrastructure)
+            only_infrastructure=true
+            ;;
+        --refresh)
+            export GLAB_REFRESH_CACHE=1
+            ;;
+        --scale)
+            scale=true
+            ;;
+        *)
+            help
+            exit 1
+            ;;
+    esac
+done
 
-echo "$2"
-if [[ ! "$2" == "--only-provision" ]]; then
-#    echo "Bringing up cluster..."
-#    pulumi up -y
+if [[ ${only_provision} == false ]]; then
+    echo "Creating template replicas..."
+    spanStart replicas
+    python replicas.py "${stack}"
+    checkForError $? "failed creating template replicas"
+    spanEnd replicas
+
+    echo "Bringing up cluster..."
+    spanStart pulumi.up
+    pulumi up -y --stack "${stack}" --event-log "${trace_dir}/pulumi-events.jsonl"
     checkForError $? "failed bringing up cluster infrastrucure, cluster may be in an incomplete state"
+    spanEnd pulumi.up
 fi
 
-name=$(pulumi stack output cluster | jq -r .name)
-env_name=$(pulumi stack output environment | jq -r .name)
-master=$(pulumi stack output cluster | jq -r .masters[0])
+if [[ ${only_infrastructure} == true ]]; then
+    echo "Done!"
+    exit 0
+fi
 
-echo "Pulling down kubespray..."
-rm -rf /tmp/kubespray &> /dev/null
-git clone https://github.com/kubernetes-sigs/kubespray /tmp/kubespray
+# Read the stack outputs once and use the snapshot for everything which follows
+mkdir -p .outputs
+export GLAB_OUTPUTS_FILE="$(pwd)/.outputs/${stack}.json"
+pulumi stack output --json --stack "${stack}" > "${GLAB_OUTPUTS_FILE}"
+checkForError $? "failed reading stack outputs"
+
+name=$(jq -r .cluster.name "${GLAB_OUTPUTS_FILE}")
+env_name=$(jq -r .environment.name "${GLAB_OUTPUTS_FILE}")
+master=$(jq -r .cluster.masters[0] "${GLAB_OUTPUTS_FILE}")
+workspace="$(pwd)/.kubespray/${stack}"
+inventory=${workspace}/inventory/${env_name}/inventory.py
+
+echo "Preparing kubespray workspace..."
+spanStart kubespray.prepare
+python kubespray.py "${workspace}"
+checkForError $? "failed preparing the Kubespray workspace"
+spanEnd kubespray.prepare
 
 echo "Copying inventory over..."
-cp -r inv/${env_name} /tmp/kubespray/inventory
+cp -r inv/${env_name} "${workspace}/inventory"
 
-echo "Creating inventory file..."
-pulumi stack output cluster | python inv.py > /tmp/kubespray/inventory/${env_name}/inventory.ini
+echo "Installing dynamic inventory..."
+cp inv.py "${inventory}"
+"${inventory}" --list > /dev/null
 checkForError $? "failed generating Ansible inventory"
 
-echo "Configuring cluster..."
-ansible-playbook -i /tmp/kubespray/inventory/${env_name}/inventory.ini --become --become-user=root /tmp/kubespray/cluster.yml
-checkForError "failed provisioning the cluster, it may be in an incomplete state"
+echo "Generating download configuration..."
+"${inventory}" --download-vars "${workspace}/inventory/${env_name}/group_vars/all/downloads.json"
+checkForError $? "failed generating download configuration"
+
+echo "Generating Ansible configuration..."
+"${inventory}" --ansible-cfg "${workspace}/ansible.cfg" --base "${workspace}/ansible.cfg"
+checkForError $? "failed generating Ansible configuration"
+export ANSIBLE_CONFIG="${workspace}/ansible.cfg"
+
+# The hosts Kubespray has configured are recorded after every successful run, so that scale mode targets the nodes
+# which have not been configured yet rather than the ones added by the last pulumi up (which may not have been
+# configured if a previous run failed)
+provisioned_file="$(pwd)/.outputs/${stack}.provisioned.json"
+
+if [[ ${scale} == true ]]; then
+    if [[ ! -f "${provisioned_file}" ]]; then
+        checkForError 1 "no record of a previous Kubespray run, rerun without --scale to configure the whole cluster"
+    fi
+
+    unprovisioned='(. - $provisioned[0]) | join(",")'
+    if [[ -n $(jq -r --slurpfile provisioned "${provisioned_file}" ".cluster.masters | ${unprovisioned}" \
+            "${GLAB_OUTPUTS_FILE}") ]]; then
+        checkForError 1 "new masters cannot be added using --scale, rerun without it to configure the whole cluster"
+    fi
+
+    new_workers=$(jq -r --slurpfile provisioned "${provisioned_file}" ".cluster.workers | ${unprovisioned}" \
+        "${GLAB_OUTPUTS_FILE}")
+    if [[ -z "${new_workers}" ]]; then
+        echo "No new nodes to configure"
+        echo "Done!"
+        exit 0
+    fi
+
+    echo "Waiting for new nodes to be ready..."
+    spanStart readiness
+    python ready.py --hosts "${new_workers}"
+    checkForError $? "not every new node is ready"
+    spanEnd readiness
+
+    # scale.yml only runs against the new workers, so the facts of every other host must be current rather than
+    # served from the fact cache
+    echo "Refreshing facts of every node..."
+    spanStart ansible.facts
+    if [[ -f "${workspace}/facts.yml" ]]; then
+        "${workspace}/.venv/bin/ansible-playbook" -i "${inventory}" --become --become-user=root \
+            --flush-cache "${workspace}/facts.yml"
+    else
+        "${workspace}/.venv/bin/ansible" -i "${inventory}" --become --become-user=root all -m setup > /dev/null
+    fi
+    checkForError $? "failed gathering the facts of the cluster"
+    spanEnd ansible.facts
+
+    echo "Configuring new nodes: ${new_workers}..."
+    spanStart ansible.scale
+    "${workspace}/.venv/bin/ansible-playbook" -i "${inventory}" --become --become-user=root \
+        --limit "${new_workers}" "${workspace}/scale.yml"
+    checkForError $? "failed scaling the cluster, the new nodes may be in an incomplete state"
+    spanEnd ansible.scale
+else
+    echo "Waiting for nodes to be ready..."
+    spanStart readiness
+    python ready.py
+    checkForError $? "not every node is ready"
+    spanEnd readiness
+
+    echo "Configuring cluster..."
+    spanStart ansible.cluster
+    "${workspace}/.venv/bin/ansible-playbook" -i "${inventory}" --become --become-user=root "${workspace}/cluster.yml"
+    checkForError $? "failed provisioning the cluster, it may be in an incomplete state"
+    spanEnd ansible.cluster
+fi
+
+jq '.cluster.masters + .cluster.workers' "${GLAB_OUTPUTS_FILE}" > "${provisioned_file}.tmp" && \
+    mv "${provisioned_file}.tmp" "${provisioned_file}"
+checkForError $? "failed recording the configured nodes"
 
 echo "Pulling down kube config..."
 mkdir -p ~/.kube/custom-contexts/${name}